@@ -0,0 +1,113 @@
+""" Benchmarks of the BMW ConnectedDrive API against the local mock server.
+
+    Measures the cost of logging in, the throughput and latency of update() and iter_updates()
+    in serial and parallel mode and the time of execute_service, for fleets of 1, 10 and 1000 cars.
+    update() prints every car, its output goes to os.devnull while it is timed.
+
+    Run from the root of the repository, or after pip install -e .:
+    PYTHONPATH=. python benchmarks/bench_connecteddrive.py
+    PYTHONPATH=. python benchmarks/bench_connecteddrive.py --vehicles 1 10 --latency 0.05 --rounds 5
+"""
+
+import argparse
+import contextlib
+import logging
+import os
+import statistics
+import time
+
+from bmwcd.bmwcdapi import ConnectedDrive
+from bmwcd.mockserver import MockServer
+
+
+def percentile(values, percent):
+    """Return the percentile of a list of values."""
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def timed(function, rounds):
+    """Run function rounds times and return the durations (sec)."""
+    durations = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def quiet(function):
+    """Return function with its output to stdout sent to os.devnull."""
+    def run():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            function()
+    return run
+
+
+def drain(iterator_function):
+    """Return a function which consumes all items of iterator_function()."""
+    def run():
+        for _ in iterator_function():
+            pass
+    return run
+
+
+def report(name, vehicles, durations, items=None):
+    """Print one line with the statistics of a benchmark."""
+    line = '{:<28} {:>6} cars  median {:>9.2f} ms  p95 {:>9.2f} ms'.format(
+        name, vehicles, statistics.median(durations) * 1000, percentile(durations, 95) * 1000)
+    if items:
+        line += '  {:>10.1f} cars/s'.format(items / statistics.median(durations))
+    print(line)
+
+
+def bench(vehicles, latency, rounds, max_workers):
+    """Run all benchmarks for a fleet size."""
+    with MockServer(vehicles=vehicles, latency=latency) as server:
+        def connect(**kwargs):
+            return ConnectedDrive('user', 'password', url=server.url, auth_url=server.auth_url, lazy=True,
+                                  rate_limiter=False, background_refresh=False, **kwargs)
+
+        bmw = connect()
+        report('generate_credentials', vehicles, timed(bmw.generate_credentials, rounds))
+        bmw.start()
+
+        report('update serial', vehicles, timed(quiet(lambda: bmw.update(force=True)), rounds), vehicles)
+        report('iter_updates serial', vehicles, timed(drain(bmw.iter_updates), rounds), vehicles)
+        bmw.close()
+
+        bmw = connect(parallel=True, max_workers=max_workers)
+        bmw.start()
+        report('update parallel', vehicles, timed(quiet(lambda: bmw.update(force=True)), rounds), vehicles)
+        report('iter_updates parallel', vehicles, timed(drain(bmw.iter_updates), rounds), vehicles)
+
+        bmw.service_poller.intervals.update(first=0.01, maximum=0.1)
+        vin = bmw.cars[0]['vin']
+        report('execute_service', 1, timed(lambda: bmw.execute_service('lock', vin), rounds))
+
+        vins = [car['vin'] for car in bmw.cars]
+
+        def execute_many():
+            for future in bmw.execute_service_many('lock', vins).values():
+                future.result()
+        report('execute_service_many', vehicles, timed(execute_many, rounds), vehicles)
+        bmw.close()
+
+
+def main():
+    """Run the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vehicles', type=int, nargs='+', default=[1, 10, 1000], help='fleet sizes')
+    parser.add_argument('--latency', type=float, default=0.0, help='latency (sec) of the mock server')
+    parser.add_argument('--rounds', type=int, default=3, help='number of runs of each benchmark')
+    parser.add_argument('--max-workers', type=int, default=16, help='workers in parallel mode')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.CRITICAL)  # bmwcdapi logs every request
+
+    for vehicles in args.vehicles:
+        bench(vehicles, args.latency, args.rounds, args.max_workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,10 +4,11 @@
 class BMWConnectedDriveException(Exception):
     """ BMW ConnectedDrive API Exception class.
     """
-    def __init__(self, code, *args, **kwargs):
+    def __init__(self, code, *args, retry_after=None, **kwargs):
         self.message = ""
         super().__init__(*args, **kwargs)
         self.code = code
+        self.retry_after = retry_after
         if self.code == 401:
             self.message = 'UNAUTHORIZED'
         elif self.code == 404:
@@ -4,6 +4,9 @@ Attributes:
     username (int): BMW ConnectedDrive username (email)
     password (string): BMW ConnectedDrive password
     url(string): URL you use to login to BMW ConnectedDrive, e.g. 'www.bmw-connecteddrive.nl' or 'www.bmw-connecteddrive.de'
+
+Fill in USERNAME and PASSWORD below and run it from the command line:
+    python -m bmwcd.bmwcdapi     or     python bmwcd/bmwcdapi.py
 """
 
 # **** bmw_connecteddrive.py ****
@@ -32,19 +35,43 @@ Attributes:
 # https://www.symcon.de/forum/threads/36747-BMW-connected-drive-in-IPS?p=349074
 # ----======================================================================================================----
 
+import copy
+import hashlib
 import logging
+import os
 import sys
 import json
 import time
 import urllib.parse
 import re
 import argparse
+import shutil
+import tempfile
 import xml.etree.ElementTree as etree
-from multiprocessing import RLock
+import functools
+import threading
+import types
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import datetime
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError
 
+if not __package__:             # Started as a script, make the bmwcd package importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bmwcd.Exceptions import BMWConnectedDriveException
+from bmwcd.cache import ResponseCache
+from bmwcd.changes import ChangeTracker
+from bmwcd.imagecache import ImageCache, CHUNK_SIZE, make_key, open_mmap
+from bmwcd.ratelimit import (TokenBucket, CircuitBreaker, parse_retry_after, OPEN_CODES, TRANSIENT_CODES,
+                             MAX_RETRIES, RETRY_BACKOFF, MAX_RETRY_DELAY)
+from bmwcd.remoteservices import ServicePoller
+from bmwcd.servicehistory import ServiceHistoryStore
+from bmwcd.tokenmanager import TokenManager, REFRESH_MARGIN
+from bmwcd.vehiclestate import VehicleState
+
 # Print logger info when started from CLI
 root = logging.getLogger()
 root.setLevel(logging.INFO)
@@ -65,7 +92,14 @@ UPDATE_INTERVAL = 600   # The interval (sec) to check the API, don't hammer it,
 #######################################################################################################################################
 
 _LOGGER = logging.getLogger(__name__)
-TIMEOUT = 10
+TIMEOUT = 10            # Read timeout (sec) for a single request
+CONNECT_TIMEOUT = 5     # Connect timeout (sec) for a single request
+POOL_CONNECTIONS = 4    # Number of hosts to keep a connection pool for
+POOL_MAXSIZE = 10       # Max number of kept-alive connections per host
+MAX_WORKERS = 4         # Max number of cars which are fetched at the same time in parallel mode
+MIN_UPDATE_INTERVAL = 120   # Minimum interval (sec) between two updates
+IMAGE_WIDTH = 780       # Default width (pixels) of the render images of the cars
+IMAGE_STEP_ANGLE = 10   # Step (degrees) between the angles of the render images
 
 AUTH_API = 'https://customer.bmwgroup.com/gcdm/oauth/authenticate'
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:57.0) Gecko/20100101 Firefox/57.0"
@@ -84,27 +118,144 @@ USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:57.0) Gecko/20100101
 # https://www.bmw-connecteddrive.de/api/vehicle/remoteservices/v1/VIN/history
 ###
 
+SERVICE_CODES = {
+    'climate': 'RCN',
+    'lock': 'RDL',
+    'unlock': 'RDU',
+    'light': 'RLF',
+    'horn': 'RHB'
+}
+
+# Item of iter_updates(): the car data, or None and the error code (0 for a connection error)
+VehicleUpdate = namedtuple('VehicleUpdate', ['vin', 'car_data', 'error'])
+
+# Parts of get_vehicle_profile() with the data type and the part of its response, parts with the same data type
+# share one request
+PROFILE_PARTS = {
+    'car_data': ('dynamic', 'attributesMap'),               # get_car_data
+    'car_data_service': ('dynamic', 'vehicleMessages'),     # get_car_data_service
+    'navigation': ('navigation', None),                     # get_car_navigation
+    'efficiency': ('efficiency', None),                     # get_car_efficiency
+    'service_partner': ('servicepartner', 'dealer'),        # get_car_service_partner
+}
+# Result of get_vehicle_profile(): the data per part and the error code per part which failed
+VehicleProfile = namedtuple('VehicleProfile', ['vin', 'data', 'errors'])
+# Result of an update, published as a whole so readers never see a half finished update
+Snapshot = namedtuple('Snapshot', ['cars_data', 'errors', 'changes', 'time'])
+EMPTY_SNAPSHOT = Snapshot((), types.MappingProxyType({}), types.MappingProxyType({}), 0)
+
+
+def api_urls(url=None):
+    """Return the base urls for the vehicle and the me API of the given ConnectedDrive website."""
+    if url is None:
+        return 'https://www.bmw-connecteddrive.nl/api/vehicle', 'https://www.bmw-connecteddrive.nl/api/me'
+    if url.startswith('https://') or url.startswith('http://'):
+        return '{}/api/vehicle'.format(url), '{}/api/me'.format(url)
+    return 'https://{}/api/vehicle'.format(url), 'https://{}/api/me'.format(url)
+
+
+def credentials_values(username, password):
+    """Return the form values to post to the AUTH_API."""
+    return {
+        'username' : username,
+        'password' : password,
+        'client_id' : 'dbf0a542-ebd1-4ff0-a9a7-55172fbfce35',
+        'redirect_uri' : 'https://www.bmw-connecteddrive.com/app/default/static/external-dispatch.html',
+        'response_type' : 'token',
+        'scope' : 'authenticate_user fupo',
+        'state' : 'eyJtYXJrZXQiOiJkZSIsImxhbmd1YWdlIjoiZGUiLCJkZXN0aW5hdGlvbiI6ImxhbmRpbmdQYWdlIn0',
+        'locale' : 'DE-de'
+    }
+
+
+def parse_credentials(location):
+    """Get the access token, token type and lifetime (sec) from the redirect location of the AUTH_API.
+
+    Returns None if the credentials were rejected.
+    """
+    # https://www.bmw-connecteddrive.com/app/default/static/external-dispatch.html?error=access_denied
+    if 'error=access_denied' in location:
+        return None
+    result_m = re.match(r".*access_token=([\w\d]+).*token_type=(\w+).*expires_in=(\d+).*", location)
+    return result_m.group(1), result_m.group(2), int(result_m.group(3))
+
+
+def data_url(bmw_url, bmw_url_me, data_type, vin, utc_offset_min=0):
+    """Return the url to get the data of the given type for a car."""
+    if data_type == 'dynamic':
+        return '{}/{}/v1/{}?offset={}'.format(bmw_url, data_type, vin, str(utc_offset_min))
+    if data_type == 'get_cars':
+        return '{}/vehicles/v2'.format(bmw_url_me) # https://www.bmw-connecteddrive.nl/api/me/vehicles/v2
+    return '{}/{}/v1/{}'.format(bmw_url, data_type, vin)
+
+
+def type_of_car(car_data):
+    """Return if the car is 'electric', 'hybrid' or 'fuel' based on its data."""
+    if 'charging_status' in car_data:
+        if car_data['remaining_fuel'] == '0':
+            return 'electric'
+        return 'hybrid'
+    return 'fuel'
+
+
+def parse_execution_state(text):
+    """Get the remoteServiceStatus from the XML response of the state/execution url."""
+    root_data = etree.fromstring(text)
+    return root_data.find('remoteServiceStatus').text
+
+
 class ConnectedDrive(object):
     """ BMW ConnectedDrive """
-    def __init__(self, username=USERNAME, password=PASSWORD, url=URL, update_interval=UPDATE_INTERVAL):
-        self._lock = RLock()
+    def __init__(self, username=USERNAME, password=PASSWORD, url=URL, update_interval=UPDATE_INTERVAL,
+                 session=None, adapter=None, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=TIMEOUT, parallel=False, max_workers=MAX_WORKERS,
+                 cache=True, token_path=None, refresh_margin=REFRESH_MARGIN, background_refresh=True,
+                 lazy=False, scheduler=None, rate_limiter=True, history=None, auth_url=AUTH_API,
+                 metrics=None, image_cache=None, service_history=None):
+        self._vin_locks = {}        # A lock per VIN, held while the car is fetched during an update
+        self._vin_locks_lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+        self._fetched = {}          # Time (monotonic) each car was last fetched by update()
+        # Metrics of the requests, tokens, cache and locks, see bmwcd.metrics. None collects nothing.
+        self.metrics = metrics
+        self._start_lock = threading.Lock()
+        self._breakers_lock = threading.Lock()
+        self._image_cache_lock = threading.Lock()
+        self._image_dir = None      # Temporary directory of the image cache if none was given, removed by close()
+        # Client side rate limit, True for the default TokenBucket, False or None for no limit
+        if rate_limiter is True:
+            rate_limiter = TokenBucket()
+        self.rate_limiter = rate_limiter if rate_limiter is not False else None
+        self.host_breakers = {}
+        self.account_breaker = CircuitBreaker(username)
+        self.is_started = False
+        # Cache for slow changing data, True for an in memory cache, False or None for no cache
+        if cache is True:
+            cache = ResponseCache()
+        self.cache = cache if cache is not False else None
+        self.parallel = parallel
+        self.max_workers = max_workers
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = session if session is not None else self.create_session(adapter, pool_connections, pool_maxsize)
         self.printall = False
         self.bmw_username = username
         self.bmw_password = password
-        if url is None:
-            self.bmw_url = 'https://www.bmw-connecteddrive.nl/api/vehicle'
-            self.bmw_url_me = 'https://www.bmw-connecteddrive.nl/api/me'
-        else:
-            if url.startswith('https://'):
-                self.bmw_url = '{}/api/vehicle'.format(url)
-                self.bmw_url_me = '{}/api/me'.format(url)
-            else:
-                self.bmw_url = 'https://{}/api/vehicle'.format(url)
-                self.bmw_url_me = 'https://{}/api/me'.format(url)
-        ###self.update_interval = max(update_interval, 120)    # minimum interval is 120 seconds
-        self.update_interval = 120
+        self.bmw_url, self.bmw_url_me = api_urls(url)
+        self.auth_url = auth_url
+        self.update_interval = max(update_interval, MIN_UPDATE_INTERVAL)
+        self.scheduler = scheduler
+        self.history = history      # Optional HistoryStore (bmwcd.history) to append every snapshot to
+        # ImageCache (bmwcd.imagecache) or directory for the render images, None for a temporary directory
+        if isinstance(image_cache, str):
+            image_cache = ImageCache(image_cache)
+        self.image_cache = image_cache
+        # ServiceHistoryStore (bmwcd.servicehistory) or directory for the remote service history, None for in memory
+        if service_history is None or isinstance(service_history, str):
+            service_history = ServiceHistoryStore(service_history)
+        self.service_history = service_history
         self.is_valid_session = False
-        self.last_update_time = 0
+        self.snapshot = EMPTY_SNAPSHOT
+        self.last_update_monotonic = None
         self.is_updated = False
         self.accesstoken = None
         self.token_expires = 0
@@ -112,148 +263,533 @@ class ConnectedDrive(object):
         self.utc_offset_min = 0
         self.ignore_interval = None
         self.cars = []
+        self.changes = ChangeTracker()
         self.bmw_vin = None
         self.utc_offset_min = int(round((datetime.utcnow() - datetime.now()).total_seconds()) / 60)
         _LOGGER.debug("BMW ConnectedDrive API - UTC offset: %s minutes", self.utc_offset_min)
       
-        self.generate_credentials() # Get credentials
-        if self.is_valid_session:   # Get data
-            self.get_cars()         # Get a list with the registered cars
-            self.update()           # Get the latest data for all cars in a list
+        self.service_poller = ServicePoller(self.check_service_state, max_workers=max_workers)
+        self.token_manager = TokenManager(self.login, on_token=self.set_credentials, path=token_path,
+                                          account=self.bmw_username, refresh_margin=refresh_margin,
+                                          background=background_refresh)
+        if not lazy:                # Log in and get data now, otherwise on the first call of start()
+            if self.start():
+                self.update()       # Get the latest data for all cars in a list
+
+    @staticmethod
+    def create_session(adapter=None, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE):
+        """Create a session which keeps connections to the BMW hosts alive between requests.
+
+        A caller-supplied transport adapter can be passed, otherwise a pooled HTTPAdapter is used.
+        """
+        session = requests.Session()
+        if adapter is None:
+            adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
 
-    def update(self):
+    def close(self):
+        """Stop the token refresh and the service poller, close the session and its pooled connections.
+
+        A temporary image cache is removed, an image cache which was given is kept.
+        """
+        self.token_manager.stop()
+        self.service_poller.stop()
+        self.session.close()
+        with self._image_cache_lock:
+            if self._image_dir is not None:
+                shutil.rmtree(self._image_dir, ignore_errors=True)
+                self._image_dir = None
+                self.image_cache = None
+
+    def send(self, method, url, retry=None, endpoint=None, **kwargs):
+        """Send a request, see send_retry. If the API rejects the token it is sent once more with a new token.
+
+        A token which has not expired can still be rejected, e.g. a saved token which the API has forgotten.
+        """
+        response = self.send_retry(method, url, retry, endpoint, **kwargs)
+        headers = kwargs.get('headers') or {}
+        if response.status_code != 401 or not headers.get('Authorization', '').startswith('Bearer '):
+            return response
+        _LOGGER.warning("BMW ConnectedDrive API: token rejected, logging in again")
+        self.token_manager.invalidate(headers['Authorization'][len('Bearer '):])
+        accesstoken = self.token_manager.ensure_valid()
+        if accesstoken is None:
+            return response
+        response.close()
+        kwargs['headers'] = dict(headers, Authorization='Bearer ' + accesstoken)
+        return self.send_retry(method, url, retry, endpoint, **kwargs)
+
+    def send_retry(self, method, url, retry=None, endpoint=None, **kwargs):
+        """Send a request through the rate limiter and the circuit breakers of the host and the account.
+
+        By default GET requests are retried after a transient error or connection error, with a
+        bounded backoff or after the wait of the Retry-After header. While a circuit is open a
+        BMWConnectedDriveException is raised instead of sending the request.
+        With metrics every attempt is measured under the name of the endpoint.
+        """
+        if retry is None:
+            retry = method == 'GET'
+        kwargs.setdefault('timeout', self.timeout)
+        host_breaker = self.get_host_breaker(url)
+        attempts = MAX_RETRIES + 1 if retry else 1
+        for attempt in range(attempts):
+            self.account_breaker.before_request()
+            host_breaker.before_request()
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            backoff = RETRY_BACKOFF * 2 ** attempt
+            start_time = time.perf_counter() if self.metrics is not None else 0
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as error:
+                if self.metrics is not None:
+                    self.metrics.observe_request(endpoint or 'other', 0, time.perf_counter() - start_time, 0)
+                open_time = host_breaker.record_failure(0)
+                if attempt + 1 >= attempts or open_time:
+                    raise
+                _LOGGER.warning("BMW ConnectedDrive API: connection error, retry in %s sec: %s", backoff, error)
+                time.sleep(backoff)
+                continue
+            code = response.status_code
+            if self.metrics is not None:
+                if kwargs.get('stream'):
+                    size = int(response.headers.get('Content-Length') or 0)
+                else:
+                    size = len(response.content)
+                self.metrics.observe_request(endpoint or 'other', code, time.perf_counter() - start_time, size)
+            if code not in TRANSIENT_CODES and code not in OPEN_CODES:
+                host_breaker.record_success()
+                self.account_breaker.record_success()
+                return response
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            breaker = self.account_breaker if code in (423, 429) else host_breaker
+            open_time = breaker.record_failure(code, retry_after)
+            delay = max(backoff, open_time)
+            if attempt + 1 >= attempts or delay > MAX_RETRY_DELAY:
+                return response
+            if kwargs.get('stream'):
+                response.close()    # Give the connection back to the pool, the body is not read
+            _LOGGER.warning("BMW ConnectedDrive API: error code %s, retry in %.0f sec", code, delay)
+            time.sleep(delay)
+        return response
+
+    def get_host_breaker(self, url):
+        """Return the circuit breaker of the host of the url."""
+        host = urllib.parse.urlsplit(url).netloc
+        with self._breakers_lock:
+            if host not in self.host_breakers:
+                self.host_breakers[host] = CircuitBreaker(host)
+            return self.host_breakers[host]
+
+    @property
+    def cars_data(self):
+        """Data of the cars from the last complete update, a tuple of read-only mappings (use dict() for a copy)."""
+        return self.snapshot.cars_data
+
+    @property
+    def update_errors(self):
+        """Error code per VIN of the cars which failed in the last update."""
+        return self.snapshot.errors
+
+    @property
+    def update_changes(self):
+        """Changed fields per VIN in the last update, see subscribe()."""
+        return self.snapshot.changes
+
+    @property
+    def last_update_time(self):
+        """Time (sec since epoch) of the last update."""
+        return self.snapshot.time
+
+    def update(self, force=False):
         """ Simple BMW ConnectedDrive API.
-            Updates every x minutes as set in the update interval.
+            Updates every x minutes as set in the update interval, unless force is True.
+            With a scheduler only the cars which are due are fetched, the data of the
+            other cars is kept, see AdaptiveScheduler. A car which fails is then left out
+            of the result also in serial mode, and polled again after a backoff.
+            In parallel mode all cars are fetched at the same time and a car which fails
+            is left out of the result, its error code is kept in self.update_errors.
+            The fields which changed since the previous update are kept per VIN in
+            self.update_changes and passed to the subscribers, see subscribe().
+            While the circuit of the API is open a BMWConnectedDriveException is raised in
+            serial mode, in parallel mode its code is kept in self.update_errors.
+            The result is published as a new self.snapshot when all cars are fetched, so
+            readers of self.cars_data never wait for an update. Only the car which is being
+            fetched is locked, a car which another update fetched in the meantime is skipped.
+            A lazy ConnectedDrive logs in on the first update.
         """
-        cur_time = time.time()
-        with self._lock:
-            if cur_time - self.last_update_time > self.update_interval:
-                self.cars_data = []                                 # Make the list before loading the new data
-                for car in self.cars:                               # Multiple cars can be registered for a single user
-                    bmw_vin = car['vin']                            # Get the VIN
-                    car_name = '{} {}'.format(car['brand'], car['modelName'])
-                    car_data = self.get_car_data(bmw_vin)           # Get data for this vin
-                    # Check which data is fetched, if <> 200 the error number will be returned from self.get_car_data(bmw_vin)
-                    if type(car_data) is int:
+        if not self.start():
+            return
+        since = time.monotonic()
+        if self.scheduler is not None:
+            due = set(self.scheduler.due([car['vin'] for car in self.cars]))
+            cars = [car for car in self.cars if car['vin'] in due]
+        elif force or self.last_update_monotonic is None or \
+                since - self.last_update_monotonic >= self.update_interval:
+            cars = self.cars
+        else:
+            cars = None
+        if cars:
+            if self.parallel:
+                results = self.fetch_cars_parallel(cars, since)
+            else:
+                results = []
+                for car in cars:                                # Multiple cars can be registered for a single user
+                    car_data = self.fetch_car_once(car, since, self.fetch_car)
+                    # Check which data is fetched, if <> 200 the error number will be returned
+                    if type(car_data) is int and self.scheduler is None:
                         _LOGGER.error("BMW ConnectedDrive API: data could not be fetched, error code %s", car_data)
                         return
-                    _LOGGER.error("BMW ConnectedDrive API: car data %s", car_data)  ###debug
-                    car_data['vin'] = bmw_vin                       # Add VIN to dict           
-                    car_data['car_name'] = car_name                 # Add car name to dict
-                    if 'charging_status' in car_data:
-                        if car_data['remaining_fuel'] == '0':
-                            type_of_car = 'electric'
-                        else:
-                            type_of_car = 'hybrid'
-                    else:
-                        type_of_car = 'fuel'
-                    car_data['type_of_car'] = type_of_car           # Add car type to dict
-                    _LOGGER.info("%s: type of car: %s", car_data['car_name'], type_of_car)
-                    self.cars_data.append(car_data)                 # Make a list for every car
-                    _LOGGER.info("BMW ConnectedDrive API: data collected from %s", car_name)
-                _LOGGER.error("BMW ConnectedDrive API: data for all cars  %s", self.cars_data)
-                self.last_update_time = time.time()
-                self.is_updated = True
-                
-                # Print some data when started from CLI
-                for car in self.cars_data:
-                    print('--------------START CAR DATA--------------')
-                    for k, v in sorted(car.items()):
-                        print("{}: {}".format(k, v))
-                    print('--------------END CAR DATA--------------')
-
-                return self.cars_data
+                    # With a scheduler a failing car is kept in self.update_errors and backs off on its own
+                    results.append((car, car_data))
+            # Cars which another update fetched in the meantime are kept from its snapshot
+            skipped = [car for car, car_data in results if car_data is None]
+            results = [(car, car_data) for car, car_data in results if car_data is not None]
+            snapshot = self.store_results(results, merge=self.scheduler is not None or bool(skipped))
+            if self.scheduler is not None:
+                for car, car_data in results:
+                    self.scheduler.record(car['vin'], None if type(car_data) is int else car_data,
+                                          snapshot.changes.get(car['vin']))
+            _LOGGER.debug("BMW ConnectedDrive API: data for all cars  %s", snapshot.cars_data)
+
+            # Print some data when started from CLI
+            for car in snapshot.cars_data:
+                print('--------------START CAR DATA--------------')
+                for k, v in sorted(car.items()):
+                    print("{}: {}".format(k, v))
+                print('--------------END CAR DATA--------------')
+
+            return snapshot.cars_data
+        else:
+            if cars is None:
+                _LOGGER.debug("BMW ConnectedDrive API: no data collected from car as interval time has not yet passed.")
+            else:
+                _LOGGER.debug("BMW ConnectedDrive API: no car is due to be updated")
+            self.is_updated = False
+            return
+
+    def store_results(self, results, merge=False):
+        """Publish a list of (car, car data or error code) tuples as the new snapshot and return it.
+
+        With merge the data of cars which are not in the results is kept.
+        """
+        cars_data = {}
+        errors = {}
+        changes = {}
+        for car, car_data in results:
+            if type(car_data) is int:
+                errors[car['vin']] = car_data
+                _LOGGER.error("BMW ConnectedDrive API: data could not be fetched for %s, error code %s",
+                              car['vin'], car_data)
+                continue
+            # A read-only copy, so no reader can change the snapshot which the others see
+            cars_data[car['vin']] = types.MappingProxyType(dict(car_data))
+            changes[car['vin']] = self.changes.process(car['vin'], car_data)
+            if self.history is not None:
+                self.history.append(car['vin'], car_data)
+            _LOGGER.info("BMW ConnectedDrive API: data collected from %s", car_data['car_name'])
+        with self._publish_lock:
+            if merge:
+                for car_data in self.snapshot.cars_data:
+                    if car_data['vin'] not in cars_data and car_data['vin'] not in errors:
+                        cars_data[car_data['vin']] = car_data
+            order = {car['vin']: i for i, car in enumerate(self.cars)}
+            self.snapshot = Snapshot(tuple(sorted(cars_data.values(),
+                                                  key=lambda car_data: order.get(car_data['vin'], len(order)))),
+                                     types.MappingProxyType(errors), types.MappingProxyType(changes), time.time())
+            self.last_update_monotonic = time.monotonic()
+            self.is_updated = True
+            return self.snapshot
+
+    def start(self):
+        """Log in and get the list of cars, if that has not been done yet. Returns True if both succeeded."""
+        with self._start_lock:
+            if not self.is_started:
+                self.token_valid()          # Get credentials, unless a saved token could be used
+                if self.is_valid_session and type(self.get_cars()) is not int:  # Get a list with the registered cars
+                    self.is_started = True
+        return self.is_started
+
+    def subscribe(self, callback, vin=None, field=None):
+        """Call callback(vin, changes) when the data of a car changes during an update.
+
+        changes is a dict with (old value, new value) per changed field. Limit it to one car
+        and/or one field with vin and field. Returns a function to unsubscribe.
+        """
+        return self.changes.subscribe(callback, vin, field)
+
+    def fetch_car(self, car):
+        """Get the data of a single car from the list of registered cars.
+
+        Returns the car data with the VIN, car name and type of car added, or the error code.
+        """
+        bmw_vin = car['vin']                                        # Get the VIN
+        car_name = '{} {}'.format(car['brand'], car['modelName'])
+        car_data = self.get_car_data(bmw_vin)                       # Get data for this vin
+        if type(car_data) is int:
+            return car_data
+        _LOGGER.debug("BMW ConnectedDrive API: car data %s", car_data)
+        car_data['vin'] = bmw_vin                                   # Add VIN to dict
+        car_data['car_name'] = car_name                             # Add car name to dict
+        car_data['type_of_car'] = type_of_car(car_data)             # Add car type to dict
+        _LOGGER.info("%s: type of car: %s", car_data['car_name'], car_data['type_of_car'])
+        return car_data
+
+    def fetch_car_result(self, car):
+        """Like fetch_car, but a connection error is returned as error code 0 and an open circuit as its code."""
+        try:
+            return self.fetch_car(car)
+        except requests.exceptions.RequestException as error:
+            _LOGGER.error("BMW ConnectedDrive API: connection error for %s: %s", car['vin'], error)
+            return 0
+        except BMWConnectedDriveException as error:
+            _LOGGER.error("BMW ConnectedDrive API: %s for %s: %s", error.message, car['vin'], error)
+            return error.code
+
+    def fetch_cars_parallel(self, cars, since=None):
+        """Fetch the data of all cars concurrently on a bounded pool of workers.
+
+        Returns a list of (car, car data) tuples in the order of the cars. A car which
+        could not be fetched gets its error code instead of the car data, a connection
+        error is reported as error code 0. With since every car is fetched with
+        fetch_car_once, a car which was fetched after since gets None.
+        """
+        if not cars:
+            return []
+        if since is None:
+            fetch = self.fetch_car_result
+        else:
+            fetch = functools.partial(self.fetch_car_once, since=since, fetch=self.fetch_car_result)
+        max_workers = max(1, min(self.max_workers, len(cars)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(zip(cars, executor.map(fetch, cars)))
+
+    def get_vin_lock(self, vin):
+        """Return the lock of a car."""
+        with self._vin_locks_lock:
+            return self._vin_locks.setdefault(vin, threading.Lock())
+
+    def fetch_car_once(self, car, since, fetch):
+        """Fetch a car with fetch while holding its lock.
+
+        Returns None without fetching if another update fetched the car after since (monotonic).
+        """
+        vin_lock = self.get_vin_lock(car['vin'])
+        if self.metrics is None:
+            vin_lock.acquire()
+        else:
+            start_time = time.perf_counter()
+            vin_lock.acquire()
+            self.metrics.observe('lock_wait_seconds', time.perf_counter() - start_time)
+        try:
+            fetched = self._fetched.get(car['vin'])
+            if fetched is not None and fetched >= since:
+                _LOGGER.debug("BMW ConnectedDrive API: %s was just fetched by another update", car['vin'])
+                return None
+            car_data = fetch(car)
+            if type(car_data) is not int:
+                self._fetched[car['vin']] = time.monotonic()
+            return car_data
+        finally:
+            vin_lock.release()
+
+    def iter_updates(self, vins=None):
+        """Fetch the cars and yield a VehicleUpdate for each car as soon as its data arrives.
+
+        Fetches all cars, or the cars of vins. In parallel mode the cars are yielded in the order
+        they arrive and at most max_workers cars are fetched ahead of the consumer, so the data
+        of a large fleet is never held at once. Subscribers, the history and the scheduler get
+        every car like in update(), but self.cars_data is left as it is and nothing is printed.
+        """
+        if not self.start():
+            return
+        if vins is None:
+            cars = self.cars
+        else:
+            vins = set(vins)
+            cars = [car for car in self.cars if car['vin'] in vins]
+        if self.parallel:
+            results = self.iter_cars_parallel(cars)
+        else:
+            results = ((car, self.fetch_car_result(car)) for car in cars)
+        for car, car_data in results:
+            if type(car_data) is int:
+                changes = None
+                update = VehicleUpdate(car['vin'], None, car_data)
             else:
-                _LOGGER.error("BMW ConnectedDrive API: no data collected from car as interval time has not yet passed.")
-                self.is_updated = False
-                return
+                changes = self.changes.process(car['vin'], car_data)
+                if self.history is not None:
+                    self.history.append(car['vin'], car_data)
+                update = VehicleUpdate(car['vin'], car_data, None)
+            if self.scheduler is not None:
+                self.scheduler.record(car['vin'], update.car_data, changes)
+            yield update
+
+    def iter_cars_parallel(self, cars):
+        """Yield (car, car data or error code) tuples in the order they are fetched, max_workers at a time."""
+        if not cars:
+            return
+        cars = iter(cars)
+        max_workers = max(1, self.max_workers)
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        pending = {}
+        try:
+            for car in cars:
+                pending[executor.submit(self.fetch_car_result, car)] = car
+                if len(pending) >= max_workers:
+                    break
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    car = pending.pop(future)
+                    for next_car in cars:
+                        pending[executor.submit(self.fetch_car_result, next_car)] = next_car
+                        break
+                    yield car, future.result()
+        finally:
+            # The consumer may stop early, don't fetch the cars which have not been started yet
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
 
     def token_valid(self):
-        """Check if token is still valid, if not make new token."""
-        cur_time = time.time()
-        if int(cur_time) >= int(self.token_expires):
-            self.generate_credentials()
-            _LOGGER.debug("BMW ConnectedDrive API: new credentials obtained (token expires at: %s)",
-                         self.token_expires_date_time)
+        """Check if token is still valid, if not make new token.
+
+        When several threads find an expired token only one of them logs in.
+        """
+        if self.metrics is None:
+            self.token_manager.ensure_valid()
         else:
-            _LOGGER.debug("BMW ConnectedDrive API: current credentials still valid (token expires at: %s)",
-                         self.token_expires_date_time)
+            start_time = time.perf_counter()
+            self.token_manager.ensure_valid()
+            self.metrics.observe('token_check_duration_seconds', time.perf_counter() - start_time)
+        _LOGGER.debug("BMW ConnectedDrive API: credentials valid (token expires at: %s)",
+                      self.token_expires_date_time)
 
     def generate_credentials(self):
-        """If previous token has expired, create a new one."""
+        """Create a new token, concurrent calls result in a single login."""
+        self.token_manager.refresh()
+
+    def login(self):
+        """Log in at the AUTH_API, returns the access token and its lifetime (sec) or None.
+
+        Raises a BMWConnectedDriveException if the AUTH_API answers with an error instead of a redirect.
+        """
         headers = {
             "Content-Type": "application/x-www-form-urlencoded",
             "User-agent": USER_AGENT
         }
-        values = {
-            'username' : self.bmw_username,
-            'password' : self.bmw_password,
-            'client_id' : 'dbf0a542-ebd1-4ff0-a9a7-55172fbfce35',
-            'redirect_uri' : 'https://www.bmw-connecteddrive.com/app/default/static/external-dispatch.html',
-            'response_type' : 'token',
-            'scope' : 'authenticate_user fupo',
-            'state' : 'eyJtYXJrZXQiOiJkZSIsImxhbmd1YWdlIjoiZGUiLCJkZXN0aW5hdGlvbiI6ImxhbmRpbmdQYWdlIn0',
-            'locale' : 'DE-de'
-        }
-
-        data = urllib.parse.urlencode(values)
-        credentials_response = requests.post(AUTH_API, data=data, headers=headers, allow_redirects=False)
+        data = urllib.parse.urlencode(credentials_values(self.bmw_username, self.bmw_password))
+        credentials_response = self.send('POST', self.auth_url, retry=False, endpoint='authenticate', data=data,
+                                         headers=headers, allow_redirects=False)
         # credentials_response.statuscode will be 302
         _LOGGER.debug("BMW ConnectedDrive API: credentials response code: %s",
                       credentials_response.status_code)
-        
-        # https://www.bmw-connecteddrive.com/app/default/static/external-dispatch.html?error=access_denied
-        my_payload = credentials_response.headers['Location']
-        if 'error=access_denied' in my_payload:
-            self.is_valid_session = False
-        else:
-            result_m = re.match(".*access_token=([\w\d]+).*token_type=(\w+).*expires_in=(\d+).*", my_payload)
-            
-            token_type = result_m.group(2)
-            _LOGGER.debug("BMW ConnectedDrive API: token type: %s", token_type)
-            self.accesstoken = result_m.group(1)
-            self.token_expires = int(time.time()) + int(result_m.group(3))
-            self.token_expires_date_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.token_expires))
-            self.is_valid_session = True
-        return
-
-    def request_car_data(self, data_type, sub_data_type=None, vin=None):
-        """Get data from BMW Connected Drive."""
-        headers = {
+        if credentials_response.status_code != 302 or 'Location' not in credentials_response.headers:
+            if self.metrics is not None:
+                self.metrics.count('token_refresh_total', result='error')
+            _LOGGER.error("BMW ConnectedDrive API: error code %s while logging in", credentials_response.status_code)
+            raise BMWConnectedDriveException(
+                credentials_response.status_code, 'login failed',
+                retry_after=parse_retry_after(credentials_response.headers.get('Retry-After')))
+
+        credentials = parse_credentials(credentials_response.headers['Location'])
+        if self.metrics is not None:
+            self.metrics.count('token_refresh_total', result='denied' if credentials is None else 'ok')
+        if credentials is None:
+            _LOGGER.error("BMW ConnectedDrive API: access denied, check username and password")
+            return None
+        accesstoken, token_type, expires_in = credentials
+        _LOGGER.debug("BMW ConnectedDrive API: token type: %s", token_type)
+        return accesstoken, expires_in
+
+    def set_credentials(self, accesstoken, token_expires):
+        """Store the token from the token manager."""
+        self.accesstoken = accesstoken
+        self.token_expires = token_expires
+        self.token_expires_date_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.token_expires))
+        self.is_valid_session = accesstoken is not None
+
+    def get_headers(self):
+        """Return the headers for a request, the token is checked first so it is never an expired one."""
+        self.token_valid()  # Check if current token is still valid
+        return {
             'Content-Type': 'application/json',
             'User-agent': USER_AGENT,
             'Authorization' : 'Bearer ' + self.accesstoken
         }
 
-        self.token_valid()  # Check if current token is still valid
+    def request_car_data(self, data_type, sub_data_type=None, vin=None, headers=None):
+        """Get data from BMW Connected Drive.
+
+        Without sub_data_type the whole response is returned. headers from get_headers() can be
+        passed to skip the check of the token.
+        """
+        headers = self.get_headers() if headers is None else dict(headers)
         if vin is not None:
             self.bmw_vin = vin
-
-        if data_type == 'dynamic':
-            url = '{}/{}/v1/{}?offset={}'.format(self.bmw_url, data_type, self.bmw_vin, str(self.utc_offset_min))
-        elif data_type == 'get_cars':
-            url = '{}/vehicles/v2'.format(self.bmw_url_me) # https://www.bmw-connecteddrive.nl/api/me/vehicles/v2
         else:
-            url = '{}/{}/v1/{}'.format(self.bmw_url, data_type, self.bmw_vin)
-        
-        data_response = requests.get(url,
-                                     headers=headers,
-                                     allow_redirects=True) ###Timeout
-        
+            vin = self.bmw_vin  # Use a local copy, other threads can change self.bmw_vin
+
+        url = data_url(self.bmw_url, self.bmw_url_me, data_type, vin, self.utc_offset_min)
+
+        # Slow changing data is taken from the cache, a stale entry is revalidated with a conditional request
+        ttl = self.cache.ttl(data_type) if self.cache is not None else 0
+        if ttl:
+            cache_key = self.cache.make_key(data_type, None if data_type == 'get_cars' else vin,
+                                            urllib.parse.urlsplit(url).query, account=self.bmw_username)
+            payload = self.cache.get_fresh(cache_key)
+            if self.metrics is not None and payload is not None:
+                self.metrics.count('cache_requests_total', data_type=data_type, result='hit')
+            if payload is not None:
+                _LOGGER.debug("BMW ConnectedDrive API: %s taken from cache", url)
+                return self.extract_data(payload, data_type, sub_data_type)
+            cache_entry = self.cache.get(cache_key)
+            headers.update(self.cache.conditional_headers(cache_entry))
+
+        data_response = self.send('GET', url,
+                                  endpoint=data_type,
+                                  headers=headers,
+                                  allow_redirects=True)
+
+        if ttl and self.metrics is not None:
+            revalidated = data_response.status_code == 304 and cache_entry is not None
+            self.metrics.count('cache_requests_total', data_type=data_type,
+                               result='revalidated' if revalidated else 'miss')
+        if ttl and data_response.status_code == 304 and cache_entry is not None:
+            _LOGGER.debug("BMW ConnectedDrive API: %s not modified", url)
+            payload = self.cache.revalidated(cache_key, ttl)
+            return self.extract_data(payload, data_type, sub_data_type)
         if data_response.status_code == 200:
             _LOGGER.info("BMW ConnectedDrive API: connect to URL %s", url)
-            if data_type == 'dynamic' or data_type == 'servicepartner':
-                return data_response.json()[sub_data_type]
-            else:
-                return data_response.json()
+            payload = data_response.json()
+            if ttl:
+                self.cache.put(cache_key, payload, ttl,
+                               etag=data_response.headers.get('ETag'),
+                               last_modified=data_response.headers.get('Last-Modified'))
+                payload = copy.deepcopy(payload)
+            return self.extract_data(payload, data_type, sub_data_type)
         else:
             _LOGGER.error("BMW ConnectedDrive API: error code %s while getting data", data_response.status_code) ### Status melding nog toevoegen
             
         return data_response.status_code    ### was return False
     
+    @staticmethod
+    def extract_data(payload, data_type, sub_data_type=None):
+        """Return the part of the response which is asked for."""
+        if sub_data_type is not None and (data_type == 'dynamic' or data_type == 'servicepartner'):
+            return payload[sub_data_type]
+        return payload
+
     def get_cars(self):
-        """Get car data from BMW Connected Drive."""  
-        self.cars = self.request_car_data('get_cars')
+        """Get car data from BMW Connected Drive, or the error code."""
+        cars = self.request_car_data('get_cars')
+        if type(cars) is int:
+            _LOGGER.error("BMW ConnectedDrive API: list of cars could not be fetched, error code %s", cars)
+            return cars
+        self.cars = cars
         ###AANPASSEN NAAR NETTE MELDING IN LOG, INCL REFERENTIE NAAR API
         for car in self.cars:
             _LOGGER.info("BMW ConnectedDrive API - Car: %s %s, Vin: %s", car['brand'], car['modelName'], car['vin'])
@@ -275,6 +811,52 @@ class ConnectedDrive(object):
         """Get car data from BMW Connected Drive.""" 
         return self.request_car_data('dynamic', 'attributesMap', vin)
 
+    def get_vehicle_profile(self, vin, parts=None):
+        """Get several parts of the data of a car at once, all parts in PROFILE_PARTS by default.
+
+        The token is checked once, every data type is requested once, also when more parts come
+        from it, and the data types are requested at the same time. Returns a VehicleProfile with
+        the data of each part which could be fetched and the error code of each part which failed.
+        """
+        if parts is None:
+            parts = list(PROFILE_PARTS)
+        data_types = list(dict.fromkeys(PROFILE_PARTS[part][0] for part in parts))
+        headers = self.get_headers()
+
+        def fetch(data_type):
+            try:
+                return self.request_car_data(data_type, vin=vin, headers=headers)
+            except requests.exceptions.RequestException as error:
+                _LOGGER.error("BMW ConnectedDrive API: connection error for %s of %s: %s", data_type, vin, error)
+                return 0
+            except BMWConnectedDriveException as error:
+                _LOGGER.error("BMW ConnectedDrive API: %s for %s of %s: %s", error.message, data_type, vin, error)
+                return error.code
+
+        with ThreadPoolExecutor(max_workers=max(1, len(data_types))) as executor:
+            payloads = dict(zip(data_types, executor.map(fetch, data_types)))
+        data = {}
+        errors = {}
+        for part in parts:
+            data_type, sub_data_type = PROFILE_PARTS[part]
+            payload = payloads[data_type]
+            if type(payload) is int:
+                errors[part] = payload
+            else:
+                data[part] = payload if sub_data_type is None else payload.get(sub_data_type)
+        return VehicleProfile(vin, data, errors)
+
+    def get_vehicle_state(self, vin):
+        """Get car data from BMW Connected Drive as a VehicleState, or the error code."""
+        car_data = self.get_car_data(vin)
+        if type(car_data) is int:
+            return car_data
+        return VehicleState(car_data, vin=vin, type_of_car=type_of_car(car_data))
+
+    def get_vehicle_states(self):
+        """Return the data of all cars from the last update as VehicleStates."""
+        return [VehicleState.from_car_data(car_data) for car_data in self.cars_data]
+
     def get_car_location(self, vin):
         """Get car location from BMW Connected Drive."""
         return self.request_car_data('dynamic', 'attributesMap', vin)
@@ -293,7 +875,7 @@ class ConnectedDrive(object):
 
     def get_car_navigation(self, vin):
         """Get navigation data from BMW Connected Drive."""
-        map_car_navigation = self.request_car_data('navigation', vin)
+        map_car_navigation = self.request_car_data('navigation', vin=vin)
 
         if self.printall:
             _LOGGER.info('--------------START CAR NAV--------------')
@@ -305,7 +887,7 @@ class ConnectedDrive(object):
 
     def get_car_efficiency(self, vin):
         """Get efficiency data from BMW Connected Drive."""
-        map_car_efficiency = self.request_car_data('efficiency', vin)
+        map_car_efficiency = self.request_car_data('efficiency', vin=vin)
 
         if self.printall:
             _LOGGER.info('--------------START CAR EFFICIENCY--------------')
@@ -327,59 +909,177 @@ class ConnectedDrive(object):
 
         return map_car_service_partner
 
+    def sync_service_history(self, vin):
+        """Add the new entries of the remote service history of a car to self.service_history.
+
+        Only the entries after the high-water mark of the car are added. Returns the new
+        entries, oldest first, or the error code.
+        """
+        url = '{}/remoteservices/v1/{}/history'.format(self.bmw_url, vin)
+        headers = self.get_headers()
+        etag = self.service_history.history_etag(vin)
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        history_response = self.send('GET', url, endpoint='history', headers=headers, allow_redirects=True)
+        if history_response.status_code == 304:
+            return []
+        if history_response.status_code != 200:
+            _LOGGER.error("BMW ConnectedDrive API: error code %s while getting service history of %s",
+                          history_response.status_code, vin)
+            return history_response.status_code
+        return self.service_history.merge(vin, history_response.json(), etag=history_response.headers.get('ETag'))
+
+    def get_service_history(self, vin, since=None, sync=True):
+        """Get the remote service history of a car from self.service_history, synced first unless sync is False.
+
+        Returns the entries after since (creationTime) if given, oldest first, or the error code.
+        """
+        if sync:
+            new_entries = self.sync_service_history(vin)
+            if type(new_entries) is int:
+                return new_entries
+        return list(self.service_history.read(vin, since))
+
+    def get_charging_profile(self, vin):
+        """Get the charging profile of a car, it is only parsed and stored again when its fingerprint changed.
+
+        The fingerprint is the ETag of the response, it is sent back with If-None-Match, or else the
+        SHA-256 of the response. Returns the charging profile or the error code.
+        """
+        url = '{}/remoteservices/chargingprofile/v1/{}'.format(self.bmw_url, vin)
+        headers = self.get_headers()
+        fingerprint, profile = self.service_history.get_profile(vin)
+        if fingerprint is not None and not fingerprint.startswith('sha256:'):
+            headers['If-None-Match'] = fingerprint
+        profile_response = self.send('GET', url, endpoint='chargingprofile', headers=headers, allow_redirects=True)
+        if profile_response.status_code == 304 and profile is not None:
+            return copy.deepcopy(profile)
+        if profile_response.status_code != 200:
+            _LOGGER.error("BMW ConnectedDrive API: error code %s while getting charging profile of %s",
+                          profile_response.status_code, vin)
+            return profile_response.status_code
+        new_fingerprint = profile_response.headers.get('ETag') or \
+            'sha256:' + hashlib.sha256(profile_response.content).hexdigest()
+        if new_fingerprint != fingerprint or profile is None:
+            _LOGGER.debug("BMW ConnectedDrive API: charging profile of %s changed", vin)
+            profile = profile_response.json()
+            self.service_history.put_profile(vin, new_fingerprint, profile)
+        return copy.deepcopy(profile)
+
+    def get_car_image(self, vin, angle=0, width=IMAGE_WIDTH, as_mmap=False):
+        """Get the render image of a car from the image cache, it is downloaded only if it is not there yet.
+
+        Returns the file of the PNG image, or a read-only memory-mapped buffer with as_mmap,
+        or the error code if it could not be downloaded.
+        """
+        with self._image_cache_lock:
+            if self.image_cache is None:
+                self._image_dir = tempfile.mkdtemp(prefix='bmwcd-images-')
+                self.image_cache = ImageCache(self._image_dir)
+            image_cache = self.image_cache
+        key = make_key(vin, angle, width)
+        result = 'hit'
+        image_path = image_cache.get(key)
+        if image_path is None:
+            with image_cache.key_lock(key):
+                image_path = image_cache.get(key)     # Another thread may just have downloaded it
+                if image_path is None:
+                    result = 'miss'
+                    image_path = self.download_car_image(image_cache, key, vin, angle, width)
+        if self.metrics is not None:
+            self.metrics.count('cache_requests_total', data_type='image', result=result)
+        if type(image_path) is int:
+            return image_path
+        return open_mmap(image_path) if as_mmap else image_path
+
+    def download_car_image(self, image_cache, key, vin, angle, width):
+        """Stream a render image to the image cache in chunks. Returns its file or the error code."""
+        url = '{}/image/v1/{}?startAngle={}&stepAngle={}&width={}'.format(
+            self.bmw_url, vin, angle, IMAGE_STEP_ANGLE, width)
+        with self.send('GET', url, endpoint='image', headers=self.get_headers(), allow_redirects=True,
+                       stream=True) as image_response:
+            if image_response.status_code != 200:
+                _LOGGER.error("BMW ConnectedDrive API: error code %s while getting image of %s",
+                              image_response.status_code, vin)
+                return image_response.status_code
+            _LOGGER.info("BMW ConnectedDrive API: connect to URL %s", url)
+            return image_cache.put(key, image_response.iter_content(CHUNK_SIZE))
+
     def execute_service(self, service, vin):
-        """Get servicepartner data from BMW Connected Drive."""
-        self.token_valid()  # Check if current token is still valid
+        """Execute a remote service like 'lock' or 'climate' on a car and wait until it is executed.
 
-        max_retries = 9
-        interval = 10 #secs
+        Returns True if the service was executed, False if it failed or the timer expired.
+        """
+        return self.execute_service_async(service, vin).result()
 
-        service_codes = {
-            'climate': 'RCN',
-            'lock': 'RDL',
-            'unlock': 'RDU',
-            'light': 'RLF',
-            'horn': 'RHB'
-        }
+    def execute_service_async(self, service, vin, callback=None):
+        """Execute a remote service on a car without waiting for it.
 
-        headers = {
-            "Content-Type": "application/json",
-            "User-agent": USER_AGENT,
-            "Authorization" : "Bearer "+ self.accesstoken
-        }
+        Returns a Future right after the service is posted, its result becomes True if the
+        service was executed and False if it failed or the timer expired. Cancel the Future to
+        stop polling. The callback, if given, is called with the VIN and the Future when it is done.
+        Raises a RuntimeError after close().
+        """
+        if self.service_poller.stopped:
+            raise RuntimeError('ConnectedDrive is closed')
+        future = Future()
+        if self.metrics is not None:
+            future.add_done_callback(functools.partial(self.observe_service, service, time.perf_counter()))
+        if callback is not None:
+            future.add_done_callback(functools.partial(callback, vin))
 
         _LOGGER.info("BMW ConnectedDrive API - executing service %s", service)
-        command = service_codes[service]
-        remote_service_status = None
+        command = SERVICE_CODES[service]
         url = '{}/remoteservices/v1/{}/{}'.format(self.bmw_url, vin, command)
         url_check = '{}/remoteservices/v1/{}/state/execution'.format(self.bmw_url, vin)
 
-        execute_response = requests.post(url,
-                                         headers=headers,
+        try:
+            execute_response = self.send('POST', url,
+                                         endpoint='remoteservices',
+                                         headers=self.get_headers(),
                                          allow_redirects=True)
+        except (requests.exceptions.RequestException, BMWConnectedDriveException) as error:
+            future.set_exception(error)
+            return future
 
         if execute_response.status_code != 200:
             _LOGGER.error("BMW ConnectedDrive API - error during executing service %s", service)
-            return False
-
-        for i in range(max_retries):
-            time.sleep(interval)
-            remoteservices_response = requests.get(url_check,
-                                                   headers=headers,
-                                                   allow_redirects=True)
-            _LOGGER.debug("BMW ConnectedDrive API - status execstate %s %s", str(remoteservices_response.status_code), remoteservices_response.text)
-            root_data = etree.fromstring(remoteservices_response.text)
-            remote_service_status = root_data.find('remoteServiceStatus').text
-            #print(remoteServiceStatus)
-            if remote_service_status == 'EXECUTED':
-                _LOGGER.info("BMW ConnectedDrive API - executing service %s succeeded", service)
-                break
-
-        if remote_service_status != 'EXECUTED':
-            _LOGGER.error("BMW ConnectedDrive API - error during executing service %s, timer expired", service)
-            return False
-
-        return True
+            future.set_result(False)
+            return future
+
+        self.service_poller.add(service, url_check, future)
+        return future
+
+    def execute_service_many(self, service, vins, callback=None):
+        """Execute a remote service on several cars at the same time without waiting for it.
+
+        Returns a dict with a Future per VIN, see execute_service_async. To wait for all of them
+        use concurrent.futures.wait(futures.values()).
+        """
+        max_workers = max(1, min(self.max_workers, len(vins)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            posts = {vin: executor.submit(self.execute_service_async, service, vin, callback) for vin in vins}
+        return {vin: post.result() for vin, post in posts.items()}
+
+    def observe_service(self, service, start_time, future):
+        """Measure a remote service execution when its Future is done."""
+        if future.cancelled():
+            result = 'cancelled'
+        elif future.exception() is not None:
+            result = 'error'
+        else:
+            result = 'executed' if future.result() else 'failed'
+        self.metrics.observe('execute_service_duration_seconds', time.perf_counter() - start_time,
+                             service=service, result=result)
+
+    def check_service_state(self, url_check):
+        """Get the state of a remote service execution."""
+        remoteservices_response = self.send('GET', url_check,
+                                            endpoint='execution',
+                                            headers=self.get_headers(),
+                                            allow_redirects=True)
+        _LOGGER.debug("BMW ConnectedDrive API - status execstate %s %s", str(remoteservices_response.status_code), remoteservices_response.text)
+        return parse_execution_state(remoteservices_response.text)
 
 def main():
     """Show information when this script is started from CLI."""
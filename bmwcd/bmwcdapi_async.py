@@ -0,0 +1,419 @@
+""" BMW ConnectedDrive API for asyncio
+Attributes:
+    username (int): BMW ConnectedDrive username (email)
+    password (string): BMW ConnectedDrive password
+    url(string): URL you use to login to BMW ConnectedDrive, e.g. 'www.bmw-connecteddrive.nl' or 'www.bmw-connecteddrive.de'
+"""
+
+# **** bmwcdapi_async.py ****
+#
+# Same API as ConnectedDrive in bmwcdapi.py, but all network calls are coroutines using aiohttp,
+# so many cars can be polled from a single event loop without an executor thread per call.
+#
+# Usage:
+#     async with AsyncConnectedDrive(username, password, url) as bmw:
+#         cars_data = await bmw.update()
+#
+# Every request goes through the rate limiter and the circuit breakers of bmwcd.ratelimit, like in ConnectedDrive.
+
+import asyncio
+import logging
+import time
+import urllib.parse
+from datetime import datetime
+import aiohttp
+
+from bmwcd.Exceptions import BMWConnectedDriveException
+from bmwcd.bmwcdapi import (USERNAME, PASSWORD, URL, UPDATE_INTERVAL, MIN_UPDATE_INTERVAL, TIMEOUT, CONNECT_TIMEOUT, POOL_MAXSIZE,
+                            MAX_WORKERS, AUTH_API, USER_AGENT, SERVICE_CODES, api_urls, credentials_values,
+                            parse_credentials, data_url, type_of_car, parse_execution_state, VehicleUpdate,
+                            PROFILE_PARTS, VehicleProfile)
+from bmwcd.ratelimit import (TokenBucket, CircuitBreaker, parse_retry_after, OPEN_CODES, TRANSIENT_CODES,
+                             MAX_RETRIES, RETRY_BACKOFF, MAX_RETRY_DELAY)
+from bmwcd.remoteservices import poll_intervals
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class AsyncConnectedDrive(object):
+    """ BMW ConnectedDrive for asyncio
+
+        Pass the same TokenBucket as rate_limiter to several instances, also ConnectedDrive ones,
+        to share one limit between them.
+    """
+    def __init__(self, username=USERNAME, password=PASSWORD, url=URL, update_interval=UPDATE_INTERVAL,
+                 session=None, pool_maxsize=POOL_MAXSIZE, connect_timeout=CONNECT_TIMEOUT, read_timeout=TIMEOUT,
+                 max_workers=MAX_WORKERS, auth_url=AUTH_API, rate_limiter=True):
+        self._lock = asyncio.Lock()
+        self._token_lock = asyncio.Lock()
+        # Client side rate limit, True for the default TokenBucket, False or None for no limit
+        if rate_limiter is True:
+            rate_limiter = TokenBucket()
+        self.rate_limiter = rate_limiter if rate_limiter is not False else None
+        self.host_breakers = {}
+        self.account_breaker = CircuitBreaker(username)
+        self._own_session = session is None
+        self.session = session
+        self.pool_maxsize = pool_maxsize
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.max_workers = max_workers
+        self.printall = False
+        self.bmw_username = username
+        self.bmw_password = password
+        self.bmw_url, self.bmw_url_me = api_urls(url)
+        self.auth_url = auth_url
+        self.update_interval = max(update_interval, MIN_UPDATE_INTERVAL)
+        self.is_valid_session = False
+        self.last_update_time = 0
+        self.is_updated = False
+        self.accesstoken = None
+        self.token_expires = 0
+        self.token_expires_date_time = 0
+        self.cars = []
+        self.cars_data = []
+        self.update_errors = {}
+        self.utc_offset_min = int(round((datetime.utcnow() - datetime.now()).total_seconds()) / 60)
+
+    async def __aenter__(self):
+        try:
+            await self.start()
+        except BaseException:
+            await self.close()      # __aexit__ is not called when __aenter__ fails
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def start(self):
+        """Log in and get the data of all cars, the async version of the ConnectedDrive constructor."""
+        await self.generate_credentials()   # Get credentials
+        # Get a list with the registered cars and the latest data for all cars
+        if self.is_valid_session and type(await self.get_cars()) is not int:
+            await self.update()
+
+    def get_session(self):
+        """Return the session, it is created on first use because it must be made inside the event loop."""
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit_per_host=self.pool_maxsize)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self.session
+
+    async def close(self):
+        """Close the session if it was created by this class."""
+        if self._own_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def get_host_breaker(self, url):
+        """Return the circuit breaker of the host of the url."""
+        host = urllib.parse.urlsplit(url).netloc
+        if host not in self.host_breakers:
+            self.host_breakers[host] = CircuitBreaker(host)
+        return self.host_breakers[host]
+
+    async def send(self, method, url, retry=None, **kwargs):
+        """Send a request through the rate limiter and the circuit breakers, see ConnectedDrive.send_retry.
+
+        Returns the response with its body read, so its connection is back in the pool.
+        """
+        if retry is None:
+            retry = method == 'GET'
+        kwargs.setdefault('timeout', self.timeout)
+        host_breaker = self.get_host_breaker(url)
+        attempts = MAX_RETRIES + 1 if retry else 1
+        for attempt in range(attempts):
+            self.account_breaker.before_request()
+            host_breaker.before_request()
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire_async()
+            backoff = RETRY_BACKOFF * 2 ** attempt
+            try:
+                response = await self.get_session().request(method, url, **kwargs)
+                await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                open_time = host_breaker.record_failure(0)
+                if attempt + 1 >= attempts or open_time:
+                    raise
+                _LOGGER.warning("BMW ConnectedDrive API: connection error, retry in %s sec: %s", backoff, error)
+                await asyncio.sleep(backoff)
+                continue
+            code = response.status
+            if code not in TRANSIENT_CODES and code not in OPEN_CODES:
+                host_breaker.record_success()
+                self.account_breaker.record_success()
+                return response
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            breaker = self.account_breaker if code in (423, 429) else host_breaker
+            open_time = breaker.record_failure(code, retry_after)
+            delay = max(backoff, open_time)
+            if attempt + 1 >= attempts or delay > MAX_RETRY_DELAY:
+                return response
+            _LOGGER.warning("BMW ConnectedDrive API: error code %s, retry in %.0f sec", code, delay)
+            await asyncio.sleep(delay)
+        return response
+
+    async def update(self):
+        """ Simple BMW ConnectedDrive API.
+            Updates every x minutes as set in the update interval.
+            All cars are fetched at the same time, a car which fails is left out of the result
+            and its error code is kept in self.update_errors, also while a circuit is open.
+        """
+        cur_time = time.time()
+        async with self._lock:
+            if cur_time - self.last_update_time > self.update_interval:
+                results = await self.fetch_cars_parallel(self.cars)
+                cars_data = []
+                self.update_errors = {}
+                for car, car_data in results:
+                    if type(car_data) is int:
+                        self.update_errors[car['vin']] = car_data
+                        _LOGGER.error("BMW ConnectedDrive API: data could not be fetched for %s, error code %s",
+                                      car['vin'], car_data)
+                        continue
+                    cars_data.append(car_data)
+                    _LOGGER.info("BMW ConnectedDrive API: data collected from %s", car_data['car_name'])
+                self.cars_data = cars_data
+                self.last_update_time = time.time()
+                self.is_updated = True
+                return self.cars_data
+            else:
+                _LOGGER.debug("BMW ConnectedDrive API: no data collected from car as interval time has not yet passed.")
+                self.is_updated = False
+                return
+
+    async def fetch_car(self, car):
+        """Get the data of a single car from the list of registered cars.
+
+        Returns the car data with the VIN, car name and type of car added, or the error code.
+        """
+        bmw_vin = car['vin']
+        car_data = await self.get_car_data(bmw_vin)
+        if type(car_data) is int:
+            return car_data
+        car_data['vin'] = bmw_vin
+        car_data['car_name'] = '{} {}'.format(car['brand'], car['modelName'])
+        car_data['type_of_car'] = type_of_car(car_data)
+        return car_data
+
+    async def fetch_cars_parallel(self, cars):
+        """Fetch the data of all cars concurrently, at most max_workers at the same time.
+
+        Returns a list of (car, car data) tuples in the order of the cars. A car which
+        could not be fetched gets its error code instead of the car data, a connection
+        error is reported as error code 0.
+        """
+        semaphore = asyncio.Semaphore(max(1, self.max_workers))
+
+        async def fetch(car):
+            async with semaphore:
+                return car, await self.fetch_car_result(car)
+
+        return list(await asyncio.gather(*(fetch(car) for car in cars)))
+
+    async def fetch_car_result(self, car):
+        """Like fetch_car, but a connection error is returned as error code 0 and an open circuit as its code."""
+        try:
+            return await self.fetch_car(car)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            _LOGGER.error("BMW ConnectedDrive API: connection error for %s: %s", car['vin'], error)
+            return 0
+        except BMWConnectedDriveException as error:
+            _LOGGER.error("BMW ConnectedDrive API: %s for %s: %s", error.message, car['vin'], error)
+            return error.code
+
+    async def iter_updates(self, vins=None):
+        """Fetch the cars and yield a VehicleUpdate for each car as soon as its data arrives.
+
+        Fetches all cars, or the cars of vins, at most max_workers ahead of the consumer.
+        self.cars_data is left as it is, see ConnectedDrive.iter_updates.
+        """
+        if vins is None:
+            cars = iter(self.cars)
+        else:
+            vins = set(vins)
+            cars = (car for car in self.cars if car['vin'] in vins)
+        max_workers = max(1, self.max_workers)
+        pending = {}
+        try:
+            for car in cars:
+                pending[asyncio.ensure_future(self.fetch_car_result(car))] = car
+                if len(pending) >= max_workers:
+                    break
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    car = pending.pop(task)
+                    for next_car in cars:
+                        pending[asyncio.ensure_future(self.fetch_car_result(next_car))] = next_car
+                        break
+                    car_data = task.result()
+                    if type(car_data) is int:
+                        yield VehicleUpdate(car['vin'], None, car_data)
+                    else:
+                        yield VehicleUpdate(car['vin'], car_data, None)
+        finally:
+            # The consumer may stop early, don't leave the fetches running
+            for task in pending:
+                task.cancel()
+
+    async def token_valid(self):
+        """Check if token is still valid, if not make new token.
+
+        Concurrent callers wait for a single login instead of each logging in.
+        """
+        if int(time.time()) < int(self.token_expires):
+            return
+        async with self._token_lock:
+            if int(time.time()) >= int(self.token_expires):
+                await self.generate_credentials()
+                _LOGGER.debug("BMW ConnectedDrive API: new credentials obtained (token expires at: %s)",
+                              self.token_expires_date_time)
+
+    async def generate_credentials(self):
+        """If previous token has expired, create a new one.
+
+        Raises a BMWConnectedDriveException if the AUTH_API answers with an error instead of a redirect.
+        """
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "User-agent": USER_AGENT
+        }
+        data = urllib.parse.urlencode(credentials_values(self.bmw_username, self.bmw_password))
+        credentials_response = await self.send('POST', self.auth_url, retry=False, data=data, headers=headers,
+                                               allow_redirects=False)
+        _LOGGER.debug("BMW ConnectedDrive API: credentials response code: %s", credentials_response.status)
+        if credentials_response.status != 302 or 'Location' not in credentials_response.headers:
+            _LOGGER.error("BMW ConnectedDrive API: error code %s while logging in", credentials_response.status)
+            raise BMWConnectedDriveException(
+                credentials_response.status, 'login failed',
+                retry_after=parse_retry_after(credentials_response.headers.get('Retry-After')))
+        credentials = parse_credentials(credentials_response.headers['Location'])
+        if credentials is None:
+            self.is_valid_session = False
+        else:
+            accesstoken, token_type, expires_in = credentials
+            _LOGGER.debug("BMW ConnectedDrive API: token type: %s", token_type)
+            self.accesstoken = accesstoken
+            self.token_expires = int(time.time()) + expires_in
+            self.token_expires_date_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.token_expires))
+            self.is_valid_session = True
+
+    def get_headers(self):
+        """Return the headers for a request with the current token."""
+        return {
+            'Content-Type': 'application/json',
+            'User-agent': USER_AGENT,
+            'Authorization' : 'Bearer ' + self.accesstoken
+        }
+
+    async def request_car_data(self, data_type, sub_data_type=None, vin=None):
+        """Get data from BMW Connected Drive, the whole response without sub_data_type."""
+        await self.token_valid()  # Check if current token is still valid
+        url = data_url(self.bmw_url, self.bmw_url_me, data_type, vin, self.utc_offset_min)
+        data_response = await self.send('GET', url, headers=self.get_headers(), allow_redirects=True)
+        if data_response.status == 200:
+            _LOGGER.info("BMW ConnectedDrive API: connect to URL %s", url)
+            data = await data_response.json(content_type=None)
+            if sub_data_type is not None and (data_type == 'dynamic' or data_type == 'servicepartner'):
+                return data[sub_data_type]
+            return data
+        _LOGGER.error("BMW ConnectedDrive API: error code %s while getting data", data_response.status)
+        return data_response.status
+
+    async def get_cars(self):
+        """Get car data from BMW Connected Drive, or the error code."""
+        cars = await self.request_car_data('get_cars')
+        if type(cars) is int:
+            _LOGGER.error("BMW ConnectedDrive API: list of cars could not be fetched, error code %s", cars)
+            return cars
+        self.cars = cars
+        for car in self.cars:
+            _LOGGER.info("BMW ConnectedDrive API - Car: %s %s, Vin: %s", car['brand'], car['modelName'], car['vin'])
+        return self.cars
+
+    async def get_car_data(self, vin):
+        """Get car data from BMW Connected Drive."""
+        return await self.request_car_data('dynamic', 'attributesMap', vin)
+
+    async def get_vehicle_profile(self, vin, parts=None):
+        """Get several parts of the data of a car at once, see ConnectedDrive.get_vehicle_profile."""
+        if parts is None:
+            parts = list(PROFILE_PARTS)
+        data_types = list(dict.fromkeys(PROFILE_PARTS[part][0] for part in parts))
+        await self.token_valid()
+
+        async def fetch(data_type):
+            try:
+                return await self.request_car_data(data_type, vin=vin)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                _LOGGER.error("BMW ConnectedDrive API: connection error for %s of %s: %s", data_type, vin, error)
+                return 0
+            except BMWConnectedDriveException as error:
+                _LOGGER.error("BMW ConnectedDrive API: %s for %s of %s: %s", error.message, data_type, vin, error)
+                return error.code
+
+        payloads = dict(zip(data_types, await asyncio.gather(*(fetch(data_type) for data_type in data_types))))
+        data = {}
+        errors = {}
+        for part in parts:
+            data_type, sub_data_type = PROFILE_PARTS[part]
+            payload = payloads[data_type]
+            if type(payload) is int:
+                errors[part] = payload
+            else:
+                data[part] = payload if sub_data_type is None else payload.get(sub_data_type)
+        return VehicleProfile(vin, data, errors)
+
+    async def get_car_data_service(self, vin):
+        """Get car data from BMW Connected Drive."""
+        return await self.request_car_data('dynamic', 'vehicleMessages', vin)
+
+    async def get_car_navigation(self, vin):
+        """Get navigation data from BMW Connected Drive."""
+        return await self.request_car_data('navigation', vin=vin)
+
+    async def get_car_efficiency(self, vin):
+        """Get efficiency data from BMW Connected Drive."""
+        return await self.request_car_data('efficiency', vin=vin)
+
+    async def get_car_service_partner(self, vin):
+        """Get servicepartner data from BMW Connected Drive."""
+        return await self.request_car_data('servicepartner', 'dealer', vin)
+
+    async def execute_service(self, service, vin):
+        """Execute a remote service like 'lock' or 'climate' on a car and wait until it is executed."""
+        await self.token_valid()  # Check if current token is still valid
+
+        _LOGGER.info("BMW ConnectedDrive API - executing service %s", service)
+        command = SERVICE_CODES[service]
+        remote_service_status = None
+        url = '{}/remoteservices/v1/{}/{}'.format(self.bmw_url, vin, command)
+        url_check = '{}/remoteservices/v1/{}/state/execution'.format(self.bmw_url, vin)
+
+        execute_response = await self.send('POST', url, headers=self.get_headers(), allow_redirects=True)
+        if execute_response.status != 200:
+            _LOGGER.error("BMW ConnectedDrive API - error during executing service %s", service)
+            return False
+
+        for interval in poll_intervals():
+            await asyncio.sleep(interval)
+            remoteservices_response = await self.send('GET', url_check, headers=self.get_headers(),
+                                                      allow_redirects=True)
+            text = await remoteservices_response.text()
+            _LOGGER.debug("BMW ConnectedDrive API - status execstate %s %s", remoteservices_response.status, text)
+            remote_service_status = parse_execution_state(text)
+            if remote_service_status == 'EXECUTED':
+                _LOGGER.info("BMW ConnectedDrive API - executing service %s succeeded", service)
+                break
+
+        if remote_service_status != 'EXECUTED':
+            _LOGGER.error("BMW ConnectedDrive API - error during executing service %s, timer expired", service)
+            return False
+
+        return True
+
+    async def execute_service_many(self, service, vins):
+        """Execute a remote service on several cars at the same time, returns a dict with the result per VIN."""
+        results = await asyncio.gather(*(self.execute_service(service, vin) for vin in vins), return_exceptions=True)
+        return dict(zip(vins, results))
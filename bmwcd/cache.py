@@ -0,0 +1,143 @@
+""" Response cache for the BMW ConnectedDrive API.
+
+    Data like the specs, service and servicepartner of a car changes about once a day,
+    so it is kept for a time to live (TTL) per data type instead of fetching it on every call.
+    Stale entries keep their ETag/Last-Modified so they can be revalidated with a conditional request.
+"""
+
+import copy
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+_LOGGER = logging.getLogger(__name__)
+
+MAX_ENTRIES = 256       # Max number of responses in the cache, the least recently used is removed first
+
+# Time to live (sec) per data type, data types which are not listed are not cached
+DEFAULT_TTLS = {
+    'get_cars': 24 * 3600,
+    'specs': 24 * 3600,
+    'service': 6 * 3600,
+    'servicepartner': 24 * 3600,
+    'efficiency': 3600,
+}
+
+# Data types which belong to the account instead of a car, their key includes the account
+ACCOUNT_DATA_TYPES = ('get_cars',)
+
+CacheEntry = namedtuple('CacheEntry', ['payload', 'expires', 'etag', 'last_modified'])
+
+
+class ResponseCache(object):
+    """ LRU cache for API responses, keyed by (data type, VIN, params).
+
+        If a path is given the cache is also saved to that file, so it survives a restart.
+    """
+    def __init__(self, ttls=None, max_entries=MAX_ENTRIES, path=None):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        if self.path is not None:
+            self.load()
+
+    @staticmethod
+    def make_key(data_type, vin=None, params=None, account=None):
+        """Return the cache key for a request, the account is only part of it for ACCOUNT_DATA_TYPES."""
+        if data_type in ACCOUNT_DATA_TYPES:
+            return '{}|{}|{}|{}'.format(data_type, account or '', vin or '', params or '')
+        return '{}|{}|{}'.format(data_type, vin or '', params or '')
+
+    def ttl(self, data_type):
+        """Return the time to live (sec) for a data type, 0 means it is not cached."""
+        return self.ttls.get(data_type, 0)
+
+    def get(self, key):
+        """Return the entry for the key (fresh or stale), or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def get_fresh(self, key):
+        """Return a copy of the payload if the entry has not expired yet, otherwise None."""
+        entry = self.get(key)
+        if entry is not None and entry.expires > time.time():
+            self.hits += 1
+            return copy.deepcopy(entry.payload)
+        self.misses += 1
+        return None
+
+    @staticmethod
+    def conditional_headers(entry):
+        """Return the headers to revalidate a stale entry."""
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def put(self, key, payload, ttl, etag=None, last_modified=None):
+        """Store a response for ttl seconds."""
+        with self._lock:
+            self._entries[key] = CacheEntry(payload, time.time() + ttl, etag, last_modified)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        self.save()
+
+    def revalidated(self, key, ttl):
+        """Extend an entry after the server answered 304 Not Modified and return a copy of its payload."""
+        with self._lock:
+            entry = self._entries[key]._replace(expires=time.time() + ttl)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+        self.save()
+        return copy.deepcopy(entry.payload)
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+        self.save()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self):
+        """Load the entries from the file of the cache."""
+        try:
+            with open(self.path) as cache_file:
+                entries = json.load(cache_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as error:
+            _LOGGER.warning("BMW ConnectedDrive API: cache file %s could not be read: %s", self.path, error)
+            return
+        with self._lock:
+            for key, entry in entries:
+                self._entries[key] = CacheEntry(*entry)
+
+    def save(self):
+        """Write the entries to the file of the cache, if there is one."""
+        if self.path is None:
+            return
+        with self._lock:
+            entries = [[key, list(entry)] for key, entry in self._entries.items()]
+        tmp_path = '{}.tmp.{}'.format(self.path, threading.get_ident())
+        try:
+            with open(tmp_path, 'w') as cache_file:
+                json.dump(entries, cache_file)
+            os.replace(tmp_path, self.path)
+        except OSError as error:
+            _LOGGER.warning("BMW ConnectedDrive API: cache file %s could not be written: %s", self.path, error)
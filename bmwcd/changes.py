@@ -0,0 +1,87 @@
+""" Change detection for the data of the cars.
+
+    The previous attributesMap of each car is kept, so after an update only the fields
+    which really changed are passed to the subscribers.
+"""
+
+import logging
+import threading
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def compute_delta(old, new):
+    """Return a dict with (old value, new value) for every field which differs between two snapshots.
+
+    A field which is missing in one of the snapshots has the value None there.
+    """
+    if old is None:
+        old = {}
+    delta = {}
+    for field, value in new.items():
+        old_value = old.get(field)
+        if old_value != value:
+            delta[field] = (old_value, value)
+    for field in old.keys() - new.keys():
+        delta[field] = (old[field], None)
+    return delta
+
+
+class ChangeTracker(object):
+    """ Keep the last snapshot per VIN and notify subscribers of changed fields.
+
+        A subscriber is called with (vin, delta), where delta is the dict from compute_delta,
+        limited to the field it subscribed to, if any. The first snapshot of a car counts as
+        a change of every field (the old values are None).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshots = {}
+        self._subscribers = []
+
+    def subscribe(self, callback, vin=None, field=None):
+        """Call callback on changes, optionally only for one VIN and/or one field.
+
+        Returns a function which removes the subscription again.
+        """
+        subscriber = (callback, vin, field)
+        with self._lock:
+            self._subscribers.append(subscriber)
+
+        def unsubscribe():
+            with self._lock:
+                if subscriber in self._subscribers:
+                    self._subscribers.remove(subscriber)
+        return unsubscribe
+
+    def get_snapshot(self, vin):
+        """Return the last snapshot of a car, or None."""
+        return self._snapshots.get(vin)
+
+    def process(self, vin, snapshot):
+        """Store the new snapshot of a car, notify the subscribers and return the delta."""
+        with self._lock:
+            delta = compute_delta(self._snapshots.get(vin), snapshot)
+            self._snapshots[vin] = dict(snapshot)
+            subscribers = list(self._subscribers)
+        if delta:
+            _LOGGER.debug("BMW ConnectedDrive API: %s changed fields: %s", vin, ', '.join(sorted(delta)))
+            for callback, sub_vin, field in subscribers:
+                if sub_vin is not None and sub_vin != vin:
+                    continue
+                if field is not None:
+                    if field not in delta:
+                        continue
+                    changes = {field: delta[field]}
+                else:
+                    changes = delta
+                try:
+                    callback(vin, changes)
+                except Exception: # pylint: disable=broad-except
+                    _LOGGER.exception("BMW ConnectedDrive API: error in change callback for %s", vin)
+        return delta
+
+    def forget(self, vin):
+        """Remove the snapshot of a car, its next snapshot counts as new again."""
+        with self._lock:
+            self._snapshots.pop(vin, None)
@@ -0,0 +1,235 @@
+""" Manage the cars of many BMW ConnectedDrive accounts.
+
+    Accounts are added without logging in. On the first poll all accounts log in at the same
+    time, and then the cars of all accounts are fetched by one shared pool of workers:
+    max_workers limits the total number of requests at the same time and account_max_workers
+    the number of requests per account.
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+import requests
+
+from bmwcd.Exceptions import BMWConnectedDriveException
+from bmwcd.bmwcdapi import ConnectedDrive, UPDATE_INTERVAL
+
+_LOGGER = logging.getLogger(__name__)
+
+MAX_WORKERS = 16            # Max number of requests at the same time for all accounts
+ACCOUNT_MAX_WORKERS = 2     # Max number of requests at the same time per account
+
+
+class Fleet(object):
+    """ Shared scheduler and aggregated view of the cars of many accounts """
+    def __init__(self, max_workers=MAX_WORKERS, account_max_workers=ACCOUNT_MAX_WORKERS,
+                 update_interval=UPDATE_INTERVAL, scheduler=None):
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bmwcd-fleet')
+        self.account_max_workers = account_max_workers
+        self.update_interval = update_interval
+        self.scheduler = scheduler  # AdaptiveScheduler to poll each car only when it is due
+        self.accounts = {}
+        self.vehicles = {}          # Car data per VIN of all accounts
+        self.vehicle_accounts = {}  # Name of the account per VIN
+        self.errors = {}            # Error code per VIN, or the exception per account name
+
+    def add_account(self, name, username, password, url=None, **kwargs):
+        """Add an account, it logs in on the first poll. Returns its ConnectedDrive.
+
+        The token is refreshed when a poll needs it instead of by a timer thread per account.
+        """
+        kwargs.setdefault('background_refresh', False)
+        account = ConnectedDrive(username, password, url, lazy=True, **kwargs)
+        with self._lock:
+            self.accounts[name] = account
+        return account
+
+    def remove_account(self, name):
+        """Remove an account and the data of its cars."""
+        with self._lock:
+            account = self.accounts.pop(name)
+            for vin in [vin for vin, owner in self.vehicle_accounts.items() if owner == name]:
+                del self.vehicle_accounts[vin]
+                self.vehicles.pop(vin, None)
+        account.close()
+
+    def poll(self):
+        """Log in where needed and fetch the cars of all accounts. Returns the car data per VIN."""
+        with self._poll_lock:
+            with self._lock:
+                accounts = dict(self.accounts)
+            started = {self._executor.submit(self.poll_account, name, account): name
+                       for name, account in accounts.items()}
+            wait(started)
+            polls = []
+            for future, name in started.items():
+                if future.exception() is not None:  # An account which fails never fails the whole poll
+                    self.errors[name] = future.exception()
+                else:
+                    polls.append(future.result())
+            wait(polls)
+            with self._lock:
+                return dict(self.vehicles)
+
+    def poll_account(self, name, account):
+        """Log in if needed and give the cars of an account to at most account_max_workers lanes.
+
+        No worker waits for another one, so the shared pool can not deadlock. Returns a Future
+        which is done when all cars of the account have been fetched. Any error of the account
+        is kept in self.errors under its name instead of being raised.
+        """
+        done = Future()
+        try:
+            if not account.start():
+                self.errors[name] = 'not logged in'
+                done.set_result(None)
+                return done
+        except (requests.exceptions.RequestException, BMWConnectedDriveException) as error:
+            _LOGGER.error("BMW ConnectedDrive API: account %s could not log in: %s", name, error)
+            self.errors[name] = error
+            done.set_result(None)
+            return done
+        except Exception as error: # pylint: disable=broad-except
+            _LOGGER.exception("BMW ConnectedDrive API: account %s could not log in", name)
+            self.errors[name] = error
+            done.set_result(None)
+            return done
+        self.errors.pop(name, None)
+        try:
+            self.poll_lanes(name, account, done)
+        except Exception as error: # pylint: disable=broad-except
+            _LOGGER.exception("BMW ConnectedDrive API: error while polling account %s", name)
+            self.errors[name] = error
+            if not done.done():
+                done.set_result(None)
+        return done
+
+    def poll_lanes(self, name, account, done):
+        """Fetch the cars of an account which are due on its lanes, done gets its result when they are stored."""
+        due_cars = account.cars
+        if self.scheduler is not None:
+            due = set(self.scheduler.due([car['vin'] for car in account.cars]))
+            due_cars = [car for car in account.cars if car['vin'] in due]
+        cars = queue.Queue()
+        for car in due_cars:
+            cars.put(car)
+        results = []
+        lanes = min(self.account_max_workers, len(due_cars))
+        if not lanes:
+            self.store_account(name, account, results)
+            done.set_result(None)
+            return
+        pending = [lanes]
+
+        def lane_done(_):
+            with self._lock:
+                pending[0] -= 1
+                finished = not pending[0]
+            if finished:
+                try:
+                    self.store_account(name, account, results)
+                except Exception as error: # pylint: disable=broad-except
+                    _LOGGER.exception("BMW ConnectedDrive API: error while storing account %s", name)
+                    self.errors[name] = error
+                finally:
+                    done.set_result(None)
+
+        for _ in range(lanes):
+            self._executor.submit(self.fetch_lane, account, cars, results).add_done_callback(lane_done)
+
+    def store_account(self, name, account, results):
+        """Store the results of the cars of an account in the account and the aggregated view."""
+        order = {car['vin']: i for i, car in enumerate(account.cars)}
+        results.sort(key=lambda result: order[result[0]['vin']])
+        account.store_results(results, merge=self.scheduler is not None)
+        if self.scheduler is not None:
+            for car, car_data in results:
+                self.scheduler.record(car['vin'], None if type(car_data) is int else car_data,
+                                      account.update_changes.get(car['vin']))
+        with self._lock:
+            for car, car_data in results:
+                vin = car['vin']
+                self.vehicle_accounts[vin] = name
+                if type(car_data) is int:
+                    self.errors[vin] = car_data
+                else:
+                    self.errors.pop(vin, None)
+                    self.vehicles[vin] = car_data
+
+    @staticmethod
+    def fetch_lane(account, cars, results):
+        """Fetch cars from the queue one after another until it is empty."""
+        while True:
+            try:
+                car = cars.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results.append((car, account.fetch_car(car)))
+            except requests.exceptions.RequestException as error:
+                _LOGGER.error("BMW ConnectedDrive API: connection error for %s: %s", car['vin'], error)
+                results.append((car, 0))
+            except BMWConnectedDriveException as error:
+                _LOGGER.error("BMW ConnectedDrive API: %s for %s: %s", error.message, car['vin'], error)
+                results.append((car, error.code))
+            except Exception: # pylint: disable=broad-except
+                _LOGGER.exception("BMW ConnectedDrive API: error while fetching %s", car['vin'])
+                results.append((car, 0))
+
+    def get_vehicles(self, name=None):
+        """Return the car data of all cars, or of the cars of one account."""
+        with self._lock:
+            return [car_data for vin, car_data in self.vehicles.items()
+                    if name is None or self.vehicle_accounts.get(vin) == name]
+
+    def start(self):
+        """Poll all accounts in a background thread.
+
+        Every update_interval seconds, or with a scheduler when the first car is due.
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='bmwcd-fleet-scheduler', daemon=True)
+        self._thread.start()
+
+    def run(self):
+        """Scheduler loop of the background thread."""
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception: # pylint: disable=broad-except
+                _LOGGER.exception("BMW ConnectedDrive API: error while polling the fleet")
+            self._stop.wait(self.next_poll_delay())
+
+    def next_poll_delay(self):
+        """Return the time (sec) until the next poll."""
+        if self.scheduler is None:
+            return self.update_interval
+        next_poll = self.scheduler.next_poll_time(list(self.vehicle_accounts))
+        if next_poll is None:
+            return self.update_interval
+        return min(self.update_interval, max(1, next_poll - time.monotonic()))
+
+    def stop(self):
+        """Stop the background thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        """Stop polling and close all accounts."""
+        self.stop()
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            accounts = list(self.accounts.values())
+        for account in accounts:
+            account.close()
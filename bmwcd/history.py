@@ -0,0 +1,175 @@
+""" On-disk history of the data of the cars.
+
+    Every car gets a directory with one append-only file per field, plus one with the time of
+    each snapshot. Every value is a float64 (NaN if it is missing), so the files are columns
+    of fixed width which are read with numpy.memmap, without loading them in Python objects:
+
+        <path>/<VIN>/fields.json    names of the fields which are stored
+        <path>/<VIN>/time.f8        seconds since epoch of each snapshot
+        <path>/<VIN>/<field>.f8     value of the field in each snapshot
+"""
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+_LOGGER = logging.getLogger(__name__)
+
+# Fields of the attributesMap which are stored by default
+HISTORY_FIELDS = (
+    'mileage',
+    'remaining_fuel',
+    'chargingLevelHv',
+    'beRemainingRangeElectricKm',
+    'beRemainingRangeFuelKm',
+    'gps_lat',
+    'gps_lng',
+)
+TIME_COLUMN = 'time'
+DTYPE = np.dtype('<f8')
+
+
+def to_float(value):
+    """Return the value as float, NaN if it is missing or not a number."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class HistoryStore(object):
+    """ Append-only, columnar history per VIN """
+    def __init__(self, path, fields=HISTORY_FIELDS):
+        self._lock = threading.Lock()
+        self.path = path
+        self.fields = tuple(fields)
+        self._last_time = {}
+        self._counts = {}
+        os.makedirs(self.path, exist_ok=True)
+
+    def car_path(self, vin):
+        """Return the directory of a car."""
+        return os.path.join(self.path, vin)
+
+    def column_path(self, vin, column):
+        """Return the file of a column of a car."""
+        return os.path.join(self.car_path(vin), '{}.f8'.format(column))
+
+    def get_fields(self, vin):
+        """Return the fields which are stored for a car, they are fixed when its directory is made."""
+        try:
+            with open(os.path.join(self.car_path(vin), 'fields.json')) as fields_file:
+                return tuple(json.load(fields_file))
+        except FileNotFoundError:
+            return None
+
+    def append(self, vin, car_data, timestamp=None):
+        """Add a snapshot of a car. A snapshot which is not newer than the last one is skipped."""
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            fields = self.get_fields(vin)
+            if fields is None:
+                os.makedirs(self.car_path(vin), exist_ok=True)
+                with open(os.path.join(self.car_path(vin), 'fields.json'), 'w') as fields_file:
+                    json.dump(self.fields, fields_file)
+                fields = self.fields
+            if vin not in self._counts:
+                times = self.read_column(vin, TIME_COLUMN)
+                self._counts[vin] = len(times)
+                self._last_time[vin] = float(times[-1]) if len(times) else -math.inf
+                del times
+            if timestamp <= self._last_time[vin]:
+                _LOGGER.debug("BMW ConnectedDrive API: history of %s already has a snapshot at %s", vin, timestamp)
+                return False
+            # Write the values first and the time last, a snapshot only counts once its time is written.
+            # A column which does not match the time column after an interrupted write is repaired first.
+            size = self._counts[vin] * DTYPE.itemsize
+            for field in fields:
+                with open(self.column_path(vin, field), 'ab') as column_file:
+                    position = column_file.tell()
+                    if position > size:
+                        column_file.truncate(size)
+                    elif position < size:
+                        column_file.write(np.full((size - position) // DTYPE.itemsize, np.nan, DTYPE).tobytes())
+                    column_file.write(DTYPE.type(to_float(car_data.get(field))).tobytes())
+            with open(self.column_path(vin, TIME_COLUMN), 'ab') as column_file:
+                column_file.write(DTYPE.type(timestamp).tobytes())
+            self._last_time[vin] = timestamp
+            self._counts[vin] += 1
+            return True
+
+    def read_column(self, vin, column):
+        """Return a column of a car as a read-only memory-mapped array."""
+        column_path = self.column_path(vin, column)
+        if not os.path.exists(column_path) or os.path.getsize(column_path) < DTYPE.itemsize:
+            return np.empty(0, dtype=DTYPE)
+        return np.memmap(column_path, dtype=DTYPE, mode='r', shape=(os.path.getsize(column_path) // DTYPE.itemsize,))
+
+    def query(self, vin, fields=None, start=None, end=None):
+        """Return a dict with the time and the values of the fields of a car from start until end (sec since epoch).
+
+        The arrays are views on the memory-mapped files, copy them to keep them after the store changes.
+        """
+        if fields is None:
+            fields = self.get_fields(vin) or ()
+        times = self.read_column(vin, TIME_COLUMN)
+        first = 0 if start is None else int(np.searchsorted(times, start, side='left'))
+        last = len(times) if end is None else int(np.searchsorted(times, end, side='right'))
+        result = {TIME_COLUMN: times[first:last]}
+        for field in fields:
+            values = self.read_column(vin, field)
+            result[field] = values[first:min(last, len(values))]
+        return result
+
+    def downsample(self, vin, field, interval, start=None, end=None):
+        """Return (start time of each interval, mean value in that interval) of a field of a car.
+
+        Intervals without a value (or only NaN values) are left out.
+        """
+        data = self.query(vin, (field,), start, end)
+        times, values = data[TIME_COLUMN], data[field]
+        times = times[:len(values)]
+        valid = ~np.isnan(values)
+        times, values = times[valid], values[valid]
+        if not len(times):
+            return np.empty(0, dtype=DTYPE), np.empty(0, dtype=DTYPE)
+        buckets = np.floor(times / interval).astype(np.int64)
+        edges = np.flatnonzero(np.diff(buckets)) + 1
+        starts = np.concatenate(([0], edges))
+        sums = np.add.reduceat(values, starts)
+        counts = np.diff(np.concatenate((starts, [len(values)])))
+        return buckets[starts] * float(interval), sums / counts
+
+    def compact(self, vin, retention, now=None):
+        """Remove the snapshots of a car which are older than retention seconds. Returns the number removed."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            fields = self.get_fields(vin) or ()
+            times = self.read_column(vin, TIME_COLUMN)
+            keep_from = int(np.searchsorted(times, now - retention, side='left'))
+            count = len(times)
+            del times
+            if not keep_from:
+                return 0
+            # All columns are written to temporary files first and then replaced, the time column last
+            columns = fields + (TIME_COLUMN,)
+            for column in columns:
+                values = np.array(self.read_column(vin, column)[keep_from:count])
+                values.astype(DTYPE).tofile(self.column_path(vin, column) + '.tmp')
+            for column in columns:
+                os.replace(self.column_path(vin, column) + '.tmp', self.column_path(vin, column))
+            # The next append() reads the count and the last time again
+            self._counts.pop(vin, None)
+            self._last_time.pop(vin, None)
+            return keep_from
+
+    def vins(self):
+        """Return the VINs which have a history."""
+        return sorted(name for name in os.listdir(self.path) if os.path.isdir(os.path.join(self.path, name)))
@@ -0,0 +1,187 @@
+""" On-disk cache for the render images of the cars.
+
+    The images are stored once per content, named by the SHA-256 of their bytes, and an index
+    maps (VIN, angle, width) to the content. The same render for several cars or sizes is
+    stored once. When the images take more than max_bytes the least recently used are removed.
+    The cache only uses its own subdirectory and only ever removes files it made itself:
+
+        <path>/bmwcd-images/index.json          key and SHA-256 of each image, least recently used first
+        <path>/bmwcd-images/<sha256>.png        the image
+        <path>/bmwcd-images/download-*.tmp      an image which is being downloaded
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+_LOGGER = logging.getLogger(__name__)
+
+MAX_BYTES = 50 * 1024 * 1024    # Max size of all images together, the least recently used are removed first
+CHUNK_SIZE = 64 * 1024          # Bytes which are read from the response at a time
+IMAGE_DIR = 'bmwcd-images'      # Subdirectory of the path with the files of the cache
+INDEX_FILE = 'index.json'
+TMP_PREFIX = 'download-'
+TMP_MAX_AGE = 3600              # A download which is older (sec) than this is left over and removed
+IMAGE_NAME = re.compile(r'[0-9a-f]{64}\.png')
+
+
+def make_key(vin, angle, width):
+    """Return the key of an image in the index."""
+    return '{}_{}_{}'.format(vin, angle, width)
+
+
+def open_mmap(image_path):
+    """Return the image as a read-only memory-mapped buffer, it stays valid after the file is evicted."""
+    with open(image_path, 'rb') as image_file:
+        return mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class ImageCache(object):
+    """ Content-addressed LRU cache of images on disk """
+    def __init__(self, path, max_bytes=MAX_BYTES):
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.path = path
+        self.image_dir = os.path.join(path, IMAGE_DIR)
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key -> SHA-256, least recently used first
+        self._sizes = {}                # SHA-256 -> size (bytes) of the file
+        os.makedirs(self.image_dir, exist_ok=True)
+        self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def total_bytes(self):
+        """Size (bytes) of all images in the cache."""
+        return sum(self._sizes.values())
+
+    def image_path(self, digest):
+        """Return the file of an image."""
+        return os.path.join(self.image_dir, '{}.png'.format(digest))
+
+    def key_lock(self, key):
+        """Return the lock of a key, so an image which is missing is downloaded only once."""
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def get(self, key):
+        """Return the file of an image, None if it is not in the cache."""
+        with self._lock:
+            digest = self._entries.get(key)
+            if digest is None:
+                return None
+            image_path = self.image_path(digest)
+            if not os.path.exists(image_path):
+                _LOGGER.warning("BMW ConnectedDrive API: image %s is missing from the cache", key)
+                self.remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return image_path
+
+    def put(self, key, chunks):
+        """Write the chunks of an image to the cache without keeping them in memory. Returns its file."""
+        sha256 = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=self.image_dir, prefix=TMP_PREFIX, suffix='.tmp',
+                                         delete=False) as image_file:
+            try:
+                for chunk in chunks:
+                    if chunk:
+                        sha256.update(chunk)
+                        image_file.write(chunk)
+                        size += len(chunk)
+            except BaseException:
+                image_file.close()
+                os.remove(image_file.name)
+                raise
+        digest = sha256.hexdigest()
+        image_path = self.image_path(digest)
+        with self._lock:
+            if digest in self._sizes:
+                os.remove(image_file.name)
+            else:
+                os.replace(image_file.name, image_path)
+                self._sizes[digest] = size
+            old_digest = self._entries.pop(key, None)
+            self._entries[key] = digest
+            if old_digest is not None and old_digest != digest:
+                self.remove_unused(old_digest)
+            self.evict()
+            self.save()
+        return image_path
+
+    def remove(self, key):
+        """Remove a key, and its image if no other key has it. Must be called with the lock held."""
+        digest = self._entries.pop(key, None)
+        if digest is not None:
+            self.remove_unused(digest)
+
+    def remove_unused(self, digest):
+        """Remove the file of an image if no key has it. Must be called with the lock held."""
+        if digest in self._entries.values():
+            return
+        self._sizes.pop(digest, None)
+        try:
+            os.remove(self.image_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """Remove the least recently used images until the cache fits. Must be called with the lock held."""
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            _LOGGER.debug("BMW ConnectedDrive API: image %s removed from the cache", key)
+            self.remove(key)
+
+    def clear(self):
+        """Remove all images."""
+        with self._lock:
+            for key in list(self._entries):
+                self.remove(key)
+            self.save()
+
+    def load(self):
+        """Read the index, images which are missing are left out.
+
+        Images which are not in the index and downloads which were left over are removed.
+        """
+        try:
+            with open(os.path.join(self.image_dir, INDEX_FILE)) as index_file:
+                entries = json.load(index_file)
+        except FileNotFoundError:
+            entries = []
+        except (OSError, ValueError) as error:
+            _LOGGER.warning("BMW ConnectedDrive API: could not read image cache %s: %s", self.path, error)
+            entries = []
+        for key, digest in entries:
+            image_path = self.image_path(digest)
+            if os.path.exists(image_path):
+                self._entries[key] = digest
+                self._sizes[digest] = os.path.getsize(image_path)
+        now = time.time()
+        for name in os.listdir(self.image_dir):
+            file_path = os.path.join(self.image_dir, name)
+            try:
+                if IMAGE_NAME.fullmatch(name) and name[:-len('.png')] not in self._sizes:
+                    os.remove(file_path)
+                elif name.startswith(TMP_PREFIX) and name.endswith('.tmp') and \
+                        now - os.path.getmtime(file_path) > TMP_MAX_AGE:
+                    os.remove(file_path)    # Not a download of another process which is still running
+            except FileNotFoundError:
+                pass
+
+    def save(self):
+        """Write the index, via a temporary file so it is never half written."""
+        index_path = os.path.join(self.image_dir, INDEX_FILE)
+        with open(index_path + '.tmp', 'w') as index_file:
+            json.dump(list(self._entries.items()), index_file)
+        os.replace(index_path + '.tmp', index_path)
@@ -0,0 +1,135 @@
+""" Metrics of the BMW ConnectedDrive API.
+
+    Pass a Metrics instance to ConnectedDrive to count requests, bytes, status codes, token
+    refreshes and cache hits and to measure latencies. Without it no metrics are collected.
+    Hooks are called with every measurement, export() returns all metrics in the text format
+    of Prometheus.
+"""
+
+import bisect
+import logging
+import threading
+
+_LOGGER = logging.getLogger(__name__)
+
+PREFIX = 'bmwcd_'
+# Upper bounds (sec) of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 90.0)
+
+DESCRIPTIONS = {
+    'request_duration_seconds': 'Latency of the requests to the API per endpoint.',
+    'requests_total': 'Requests to the API per endpoint and status code (0 for a connection error).',
+    'response_bytes_total': 'Bytes received from the API per endpoint.',
+    'token_check_duration_seconds': 'Time to check the token, including a refresh when it has expired.',
+    'token_refresh_total': 'Logins to get a new token.',
+    'cache_requests_total': 'Lookups in the response cache per data type and result (hit, miss or revalidated).',
+    'lock_wait_seconds': 'Time update() waited for the lock of a car.',
+    'execute_service_duration_seconds': 'Time from posting a remote service until it was executed or failed.',
+}
+
+
+class Histogram(object):
+    """ Cumulative histogram with fixed buckets, like a Prometheus histogram """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Add a value."""
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+def format_labels(labels, extra=None):
+    """Return labels as '{key="value",...}' for the Prometheus text format."""
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for key, value in items) + '}'
+
+
+class Metrics(object):
+    """ Counters and histograms, with hooks and a Prometheus text exporter """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self._lock = threading.Lock()
+        self._hooks = []
+        self.buckets = tuple(buckets)
+        self.counters = {}
+        self.histograms = {}
+
+    def add_hook(self, callback):
+        """Call callback(name, labels, value) for every measurement. Returns a function to remove it."""
+        self._hooks.append(callback)
+        return lambda: self._hooks.remove(callback)
+
+    def call_hooks(self, name, labels, value):
+        """Pass a measurement to the hooks."""
+        for callback in list(self._hooks):
+            try:
+                callback(name, labels, value)
+            except Exception: # pylint: disable=broad-except
+                _LOGGER.exception("BMW ConnectedDrive API: error in metrics hook")
+
+    def count(self, name, value=1, **labels):
+        """Add value to a counter."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+        if self._hooks:
+            self.call_hooks(name, labels, value)
+
+    def observe(self, name, value, **labels):
+        """Add a value to a histogram."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(self.buckets)
+            histogram.observe(value)
+        if self._hooks:
+            self.call_hooks(name, labels, value)
+
+    def observe_request(self, endpoint, status, seconds, size):
+        """Measure a request to the API."""
+        self.observe('request_duration_seconds', seconds, endpoint=endpoint)
+        self.count('requests_total', endpoint=endpoint, status=status)
+        if size:
+            self.count('response_bytes_total', size, endpoint=endpoint)
+
+    def get_count(self, name, **labels):
+        """Return the value of a counter, 0 if it does not exist."""
+        return self.counters.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    def export(self):
+        """Return all metrics in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append('# HELP {}{} {}'.format(PREFIX, name, DESCRIPTIONS.get(name, name)))
+                lines.append('# TYPE {}{} counter'.format(PREFIX, name))
+                for labels, value in sorted(series.items()):
+                    lines.append('{}{}{} {}'.format(PREFIX, name, format_labels(labels), value))
+            for name, series in sorted(self.histograms.items()):
+                lines.append('# HELP {}{} {}'.format(PREFIX, name, DESCRIPTIONS.get(name, name)))
+                lines.append('# TYPE {}{} histogram'.format(PREFIX, name))
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append('{}{}_bucket{} {}'.format(PREFIX, name, format_labels(labels, ('le', bound)),
+                                                               cumulative))
+                    lines.append('{}{}_bucket{} {}'.format(PREFIX, name, format_labels(labels, ('le', '+Inf')),
+                                                           histogram.count))
+                    lines.append('{}{}_sum{} {}'.format(PREFIX, name, format_labels(labels), histogram.sum))
+                    lines.append('{}{}_count{} {}'.format(PREFIX, name, format_labels(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
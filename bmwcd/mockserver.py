@@ -0,0 +1,321 @@
+""" Local stand-in for the BMW ConnectedDrive API, to develop and benchmark without real cars.
+
+    Usage:
+        with MockServer(vehicles=10, latency=0.05) as server:
+            bmw = ConnectedDrive('user', 'password', url=server.url, auth_url=server.auth_url)
+
+    Or from the command line:
+        python -m bmwcd.mockserver --vehicles 10 --latency 0.05 --port 8080
+"""
+
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bmwcd.bmwcdapi import SERVICE_CODES
+
+_LOGGER = logging.getLogger(__name__)
+
+AUTH_PATH = '/gcdm/oauth/authenticate'
+REDIRECT_URI = 'https://www.bmw-connecteddrive.com/app/default/static/external-dispatch.html'
+EXECUTION_XML = ('<?xml version="1.0" encoding="UTF-8"?><executionStatus><serviceType>{}</serviceType>'
+                 '<remoteServiceStatus>{}</remoteServiceStatus></executionStatus>')
+# Smallest valid PNG, used as render image of the cars
+IMAGE_PNG = bytes.fromhex('89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c489'
+                          '0000000d4944415478da63f8cfc0f01f0005000201a0e2b1e10000000049454e44ae426082')
+
+
+def make_vin(number):
+    """Return a VIN for car number."""
+    return 'WBY1Z{:012d}'.format(number)
+
+
+class MockBackend(object):
+    """ State of the stand-in API: accounts, cars, tokens and remote service executions """
+    def __init__(self, vehicles=1, latency=0.0, error_rate=0.0, token_lifetime=3600, execution_time=0.0,
+                 username=None, password=None):
+        self._lock = threading.Lock()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.token_lifetime = token_lifetime
+        self.execution_time = execution_time
+        self.username = username
+        self.password = password
+        self.tokens = {}
+        self.executions = {}
+        self.history = {}
+        self.requests = {}
+        self.failures = {}      # Status code per VIN, or per endpoint like 'navigation', whose requests always fail
+        self.cars = [{'vin': make_vin(i), 'brand': 'BMW', 'modelName': 'i3 94 (+ REX)', 'series': 'I3',
+                      'basicType': 'I3 94 REX', 'bodyType': 'I01', 'licensePlate': 'MOCK-{}'.format(i)}
+                     for i in range(vehicles)]
+        self.vins = {car['vin'] for car in self.cars}
+        self.mileage = {car['vin']: 1000 + i for i, car in enumerate(self.cars)}
+
+    def count(self, endpoint):
+        """Count a request to an endpoint."""
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def login(self, username, password):
+        """Return a new token, or None if the credentials are wrong."""
+        if self.username is not None and (username, password) != (self.username, self.password):
+            return None
+        token = uuid.uuid4().hex
+        with self._lock:
+            self.tokens[token] = time.time() + self.token_lifetime
+        return token
+
+    def token_valid(self, authorization):
+        """Return True if the Authorization header has a token which has not expired."""
+        if not authorization or not authorization.startswith('Bearer '):
+            return False
+        return self.tokens.get(authorization[len('Bearer '):], 0) > time.time()
+
+    def dynamic(self, vin):
+        """Return the dynamic data of a car."""
+        mileage = self.mileage[vin]
+        now = time.time()
+        attributes = {
+            'mileage': str(mileage),
+            'remaining_fuel': '5',
+            'beRemainingRangeFuelKm': '120.0',
+            'beRemainingRangeElectricKm': '150.0',
+            'chargingLevelHv': '80.0',
+            'charging_status': 'NOCHARGING',
+            'connectorStatus': 'DISCONNECTED',
+            'door_lock_state': 'SECURED',
+            'lights_parking': 'OFF',
+            'gps_lat': '52.37',
+            'gps_lng': '4.89',
+            'unitOfLength': 'km',
+            'updateTime': time.strftime('%d.%m.%Y %H:%M:%S UTC', time.gmtime(now)),
+            'updateTime_converted_timestamp': str(int(now * 1000)),
+        }
+        messages = {'ccmMessages': [], 'cbsMessages': [
+            {'description': 'Next service', 'text': 'Vehicle check', 'id': 3, 'status': 'OK', 'date': '2019-06'}]}
+        return {'attributesMap': attributes, 'vehicleMessages': messages}
+
+    def execute(self, vin, command):
+        """Start a remote service execution."""
+        event_id = uuid.uuid4().hex
+        with self._lock:
+            self.executions[vin] = (command, time.time())
+            self.history.setdefault(vin, []).append({
+                'eventId': event_id, 'type': command, 'status': 'EXECUTED',
+                'creationTime': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime())})
+        return event_id
+
+    def execution_state(self, vin):
+        """Return the XML with the state of the last remote service execution of a car."""
+        command, started = self.executions.get(vin, ('', 0))
+        status = 'EXECUTED' if time.time() - started >= self.execution_time else 'PENDING'
+        return EXECUTION_XML.format(command, status)
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    """ HTTP handler which answers like the BMW ConnectedDrive API """
+    protocol_version = 'HTTP/1.1'   # Keep-alive, like the real API
+    disable_nagle_algorithm = True  # Headers and body are written separately, don't wait for a delayed ACK
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        _LOGGER.debug("Mock ConnectedDrive: " + format, *args)
+
+    @property
+    def backend(self):
+        """Return the MockBackend of the server."""
+        return self.server.backend
+
+    def send_body(self, code, body=b'', content_type='application/json', headers=None):
+        """Send a response with a body, or 304 without it if the request has the ETag in If-None-Match."""
+        etag = (headers or {}).get('ETag')
+        if code == 200 and etag is not None and self.headers.get('If-None-Match') == etag:
+            code, body = 304, b''
+        if isinstance(body, str):
+            body = body.encode()
+        elif not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def simulate(self, endpoint, vin=None):
+        """Count the request, wait for the latency and return True if an error should be simulated."""
+        self.backend.count(endpoint)
+        if self.backend.latency:
+            time.sleep(self.backend.latency)
+        code = self.backend.failures.get(vin, self.backend.failures.get(endpoint))
+        if code is not None:
+            self.send_body(code, {'error': 'simulated error'})
+            return True
+        if self.backend.error_rate and random.random() < self.backend.error_rate:
+            self.send_body(500, {'error': 'simulated error'})
+            return True
+        return False
+
+    def do_POST(self): # pylint: disable=invalid-name
+        """Handle the login and the remote services."""
+        path = urllib.parse.urlsplit(self.path).path
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode() if length else ''
+        if path == AUTH_PATH:
+            if self.simulate('authenticate'):
+                return
+            values = urllib.parse.parse_qs(body)
+            token = self.backend.login(values.get('username', [None])[0], values.get('password', [None])[0])
+            if token is None:
+                location = '{}?error=access_denied'.format(REDIRECT_URI)
+            else:
+                location = '{}#state=mock&access_token={}&token_type=Bearer&expires_in={}'.format(
+                    REDIRECT_URI, token, self.backend.token_lifetime)
+            self.send_body(302, headers={'Location': location})
+            return
+        parts = path.strip('/').split('/')
+        # /api/vehicle/remoteservices/v1/VIN/CODE
+        if len(parts) == 6 and parts[:4] == ['api', 'vehicle', 'remoteservices', 'v1']:
+            if self.check(parts[4]) or self.simulate('remoteservices', parts[4]):
+                return
+            if parts[5] not in SERVICE_CODES.values():
+                self.send_body(404, {'error': 'unknown service'})
+                return
+            event_id = self.backend.execute(parts[4], parts[5])
+            self.send_body(200, {'executionStatus': {'eventId': event_id, 'status': 'INITIATED'}})
+            return
+        self.send_body(404, {'error': 'not found'})
+
+    def do_GET(self): # pylint: disable=invalid-name
+        """Handle the data of the cars."""
+        split = urllib.parse.urlsplit(self.path)
+        parts = split.path.strip('/').split('/')
+        backend = self.backend
+        if parts == ['api', 'me', 'vehicles', 'v2']:
+            if self.check() or self.simulate('vehicles'):
+                return
+            self.send_body(200, backend.cars)
+            return
+        if len(parts) < 5 or parts[:2] != ['api', 'vehicle']:
+            self.send_body(404, {'error': 'not found'})
+            return
+        data_type = parts[2]
+        if data_type == 'remoteservices':
+            self.get_remoteservices(parts[3:])
+            return
+        vin = parts[4]
+        if self.check(vin) or self.simulate(data_type, vin):
+            return
+        if data_type == 'dynamic':
+            self.send_body(200, backend.dynamic(vin))
+        elif data_type == 'navigation':
+            self.send_body(200, {'latitude': 52.37, 'longitude': 4.89, 'isoCountryCode': 'NLD',
+                                 'auxPowerRegular': 1.4, 'socmax': 22.0, 'vehicleTracking': True})
+        elif data_type == 'efficiency':
+            self.send_body(200, {'modelType': 'BEV', 'efficiencyQuotient': 72, 'lastTripList': [
+                {'name': 'LASTTRIP_DELTA_KM', 'lastTrip': '12.0', 'unit': 'KM'}]})
+        elif data_type == 'servicepartner':
+            self.send_body(200, {'dealer': {'name': 'Mock BMW dealer', 'city': 'Amsterdam', 'country': 'NL'}})
+        elif data_type == 'specs':
+            self.send_body(200, [{'key': 'WEIGHT_MAX', 'value': '1700'}], headers={'ETag': '"specs-1"'})
+        elif data_type == 'service':
+            self.send_body(200, [{'name': 'Vehicle check', 'status': 'OK'}])
+        elif data_type == 'image':
+            self.send_body(200, IMAGE_PNG, content_type='image/png')
+        else:
+            self.send_body(404, {'error': 'not found'})
+
+    def get_remoteservices(self, parts):
+        """Handle the state, history and charging profile of the remote services."""
+        backend = self.backend
+        # remoteservices/v1/VIN/state/execution, remoteservices/v1/VIN/history, remoteservices/chargingprofile/v1/VIN
+        if parts[0] == 'chargingprofile' and len(parts) == 3:
+            vin, endpoint = parts[2], 'chargingprofile'
+        elif parts[0] == 'v1' and parts[2:] == ['state', 'execution']:
+            vin, endpoint = parts[1], 'execution'
+        elif parts[0] == 'v1' and parts[2:] == ['history']:
+            vin, endpoint = parts[1], 'history'
+        else:
+            self.send_body(404, {'error': 'not found'})
+            return
+        if self.check(vin) or self.simulate(endpoint, vin):
+            return
+        if endpoint == 'execution':
+            self.send_body(200, backend.execution_state(vin), content_type='application/xml')
+        elif endpoint == 'history':
+            history = list(backend.history.get(vin, []))
+            self.send_body(200, history, headers={'ETag': '"history-{}"'.format(len(history))})
+        else:
+            self.send_body(200, {'weeklyPlanner': {'climatizationEnabled': False, 'chargingMode': 'IMMEDIATE_CHARGING',
+                                                   'chargingPreferences': 'NO_PRESELECTION'}},
+                           headers={'ETag': '"chargingprofile-1"'})
+
+    def check(self, vin=None):
+        """Send an error and return True if the token is not valid or the VIN is not known."""
+        if not self.backend.token_valid(self.headers.get('Authorization')):
+            self.send_body(401, {'error': 'invalid_token'})
+            return True
+        if vin is not None and vin not in self.backend.vins:
+            self.send_body(404, {'error': 'unknown vehicle'})
+            return True
+        return False
+
+
+class MockServer(object):
+    """ Run a MockBackend on a local port in a background thread """
+    def __init__(self, host='127.0.0.1', port=0, **kwargs):
+        self.backend = MockBackend(**kwargs)
+        self.httpd = ThreadingHTTPServer((host, port), MockRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.backend = self.backend
+        self.thread = None
+        self.url = 'http://{}:{}'.format(*self.httpd.server_address[:2])
+        self.auth_url = self.url + AUTH_PATH
+
+    def start(self):
+        """Start serving in a background thread."""
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='bmwcd-mockserver', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    """Run the mock server from the command line."""
+    parser = argparse.ArgumentParser(description='Local stand-in for the BMW ConnectedDrive API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--vehicles', type=int, default=1, help='number of cars of the account')
+    parser.add_argument('--latency', type=float, default=0.0, help='latency (sec) of every request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='part of the requests which fail with 500')
+    parser.add_argument('--execution-time', type=float, default=0.0,
+                        help='time (sec) before a remote service is executed')
+    args = parser.parse_args()
+    server = MockServer(args.host, args.port, vehicles=args.vehicles, latency=args.latency,
+                        error_rate=args.error_rate, execution_time=args.execution_time)
+    print('Mock ConnectedDrive API at {}, log in at {}'.format(server.url, server.auth_url))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
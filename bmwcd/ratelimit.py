@@ -0,0 +1,144 @@
+""" Rate limiter and circuit breaker for the BMW ConnectedDrive API.
+
+    The TokenBucket limits the number of requests per second on the client side, for threads
+    and for asyncio. The CircuitBreaker stops sending requests for a while when the API answers
+    that it is overloaded (429), in maintenance (503), that the account is locked (423) or keeps
+    failing, and raises a BMWConnectedDriveException instead until it is closed again.
+"""
+
+import asyncio
+import email.utils
+import logging
+import threading
+import time
+
+from bmwcd.Exceptions import BMWConnectedDriveException
+
+_LOGGER = logging.getLogger(__name__)
+
+RATE = 5.0              # Requests per second
+BURST = 20              # Max number of requests in a burst
+FAILURE_THRESHOLD = 5   # Open the circuit after this many failures in a row
+RESET_TIMEOUT = 60      # Time (sec) the circuit stays open, unless the API tells otherwise with Retry-After
+MAX_RESET_TIMEOUT = 3600
+MAX_RETRIES = 2         # Max number of retries of a request after a transient error
+RETRY_BACKOFF = 1.0     # Wait (sec) before the first retry, doubled for every next retry
+MAX_RETRY_DELAY = 10    # Don't retry if the API asks to wait longer than this (sec)
+
+# Status codes which open the circuit at once, with the time (sec) it stays open if there is no Retry-After
+OPEN_CODES = {
+    423: MAX_RESET_TIMEOUT,     # ACCOUNT_LOCKED
+    429: RESET_TIMEOUT,         # TOO_MANY_REQUESTS
+    503: RESET_TIMEOUT,         # SERVICE_MAINTENANCE
+}
+# Status codes which are worth a retry after a short wait
+TRANSIENT_CODES = (429, 500, 502, 503, 504)
+
+
+def parse_retry_after(value):
+    """Return the seconds to wait from a Retry-After header, which has seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class TokenBucket(object):
+    """ Client side rate limiter: rate requests per second with bursts of at most burst requests """
+    def __init__(self, rate=RATE, burst=BURST):
+        self._lock = threading.Lock()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        """Take a token and return 0 if there is one, otherwise return the time (sec) until there is one."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Take a token, wait until there is one."""
+        wait = self.reserve()
+        while wait:
+            time.sleep(wait)
+            wait = self.reserve()
+
+    async def acquire_async(self):
+        """Take a token, wait in the event loop until there is one."""
+        wait = self.reserve()
+        while wait:
+            await asyncio.sleep(wait)
+            wait = self.reserve()
+
+
+class CircuitBreaker(object):
+    """ Fail fast while the API is down or refuses requests.
+
+        closed: requests are sent, failures are counted.
+        open: requests raise a BMWConnectedDriveException with the code which opened the circuit.
+        half open: after the reset timeout requests are sent again, the first failure opens it again.
+    """
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self._lock = threading.Lock()
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.code = None
+        self.open_until = 0
+
+    def before_request(self):
+        """Raise a BMWConnectedDriveException if the circuit is open."""
+        with self._lock:
+            now = time.monotonic()
+            if self.code is not None and now < self.open_until:
+                raise BMWConnectedDriveException(self.code, 'circuit of {} is open'.format(self.name),
+                                                 retry_after=self.open_until - now)
+
+    def record_success(self):
+        """The API answered normally, close the circuit.
+
+        An open circuit stays open, the answer is to a request which was sent before it opened.
+        """
+        with self._lock:
+            if self.code is not None and time.monotonic() < self.open_until:
+                return
+            if self.code is not None:
+                _LOGGER.info("BMW ConnectedDrive API: circuit of %s closed", self.name)
+            self.failures = 0
+            self.code = None
+
+    def record_failure(self, code, retry_after=None):
+        """The API failed with a status code (0 for a connection error), open the circuit if needed.
+
+        Returns the time (sec) the circuit is open, 0 if it is still closed.
+        """
+        with self._lock:
+            self.failures += 1
+            if code in OPEN_CODES:
+                timeout = OPEN_CODES[code]
+            elif self.failures >= self.failure_threshold or self.code is not None:
+                timeout = self.reset_timeout
+            else:
+                return 0
+            if retry_after is not None:
+                timeout = min(retry_after, MAX_RESET_TIMEOUT)
+            self.code = code or 503     # A connection error counts as SERVICE_MAINTENANCE
+            self.open_until = time.monotonic() + timeout
+            _LOGGER.error("BMW ConnectedDrive API: circuit of %s open for %.0f sec, error code %s",
+                          self.name, timeout, code)
+            return timeout
@@ -0,0 +1,140 @@
+""" Polling of remote services for the BMW ConnectedDrive API.
+
+    After a remote service (lock, climate, ...) is posted, the car reports its progress at the
+    state/execution url. One ServicePoller polls the executions of all cars: it keeps them sorted
+    by their next poll time and hands due polls to a small pool of workers, so a remote service
+    does not keep a thread busy while it is waiting.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import InvalidStateError, ThreadPoolExecutor
+
+_LOGGER = logging.getLogger(__name__)
+
+POLL_INTERVAL_FIRST = 2     # First poll (sec) after the remote service was posted
+POLL_INTERVAL_MAX = 15      # Max time (sec) between two polls
+POLL_BACKOFF = 1.5          # Factor to increase the time between polls with
+EXECUTION_TIMEOUT = 90      # Give up (sec) if the remote service has not been executed by then
+POLL_WORKERS = 4            # Max number of polls which are done at the same time
+
+
+def poll_intervals(first=POLL_INTERVAL_FIRST, factor=POLL_BACKOFF, maximum=POLL_INTERVAL_MAX,
+                   timeout=EXECUTION_TIMEOUT):
+    """Yield the times (sec) to wait between polls: fast at first, then slower until the timeout."""
+    interval = first
+    waited = 0
+    while waited < timeout:
+        interval = min(interval, maximum, timeout - waited)
+        yield interval
+        waited += interval
+        interval *= factor
+
+
+def resolve(future, result=None, error=None):
+    """Set the result, or the exception if error is given, of a future unless the caller cancelled it."""
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+class ServicePoller(object):
+    """ Poll the state of remote service executions until they are executed or time out.
+
+        check_state is a callable which gets the state/execution url and returns the
+        remoteServiceStatus. The future of an execution gets True if it was executed
+        and False if it timed out. A future which the caller cancels is not polled anymore.
+    """
+    def __init__(self, check_state, max_workers=POLL_WORKERS, first=POLL_INTERVAL_FIRST, factor=POLL_BACKOFF,
+                 maximum=POLL_INTERVAL_MAX, timeout=EXECUTION_TIMEOUT):
+        self._check_state = check_state
+        self._condition = threading.Condition()
+        self._queue = []
+        self._counter = itertools.count()
+        self._thread = None
+        self._stopped = False
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.intervals = dict(first=first, factor=factor, maximum=maximum, timeout=timeout)
+
+    @property
+    def stopped(self):
+        """True after stop(), no executions can be added anymore."""
+        return self._stopped
+
+    def add(self, service, url_check, future):
+        """Start polling an execution, the result is set on the future."""
+        if self._stopped:
+            raise RuntimeError('service poller is stopped')
+        intervals = poll_intervals(**self.intervals)
+        self.schedule(service, url_check, future, intervals)
+        with self._condition:
+            if self._thread is None and not self._stopped:
+                self._thread = threading.Thread(target=self.run, name='bmwcd-service-poller', daemon=True)
+                self._thread.start()
+
+    def schedule(self, service, url_check, future, intervals):
+        """Put the next poll of an execution in the queue, or time out if there are no polls left."""
+        if future.cancelled():
+            return
+        interval = next(intervals, None)
+        if interval is None:
+            _LOGGER.error("BMW ConnectedDrive API - error during executing service %s, timer expired", service)
+            resolve(future, False)
+            return
+        with self._condition:
+            if self._stopped:
+                resolve(future, False)
+                return
+            heapq.heappush(self._queue, (time.monotonic() + interval, next(self._counter),
+                                         (service, url_check, future, intervals)))
+            self._condition.notify()
+
+    def run(self):
+        """Wait for the next due poll and hand it to the workers, until the poller is stopped."""
+        while True:
+            with self._condition:
+                while not self._stopped and (not self._queue or self._queue[0][0] > time.monotonic()):
+                    timeout = self._queue[0][0] - time.monotonic() if self._queue else None
+                    self._condition.wait(timeout)
+                if self._stopped:
+                    return
+                _, _, execution = heapq.heappop(self._queue)
+            self._executor.submit(self.poll, *execution)
+
+    def stop(self):
+        """Stop the thread and the workers. Executions which are still polled get False."""
+        with self._condition:
+            self._stopped = True
+            executions = [execution for _, _, execution in self._queue]
+            self._queue = []
+            self._condition.notify()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self._executor.shutdown(wait=True)
+        for service, _, future, _ in executions:
+            if not future.done():
+                _LOGGER.warning("BMW ConnectedDrive API - stopped polling service %s", service)
+                resolve(future, False)
+
+    def poll(self, service, url_check, future, intervals):
+        """Check the state of an execution once."""
+        if future.cancelled():
+            return
+        try:
+            remote_service_status = self._check_state(url_check)
+        except Exception as error: # pylint: disable=broad-except
+            resolve(future, error=error)
+            return
+        if remote_service_status == 'EXECUTED':
+            _LOGGER.info("BMW ConnectedDrive API - executing service %s succeeded", service)
+            resolve(future, True)
+        else:
+            self.schedule(service, url_check, future, intervals)
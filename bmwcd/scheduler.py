@@ -0,0 +1,100 @@
+""" Adaptive polling scheduler for the BMW ConnectedDrive API.
+
+    Picks the next poll time of each car from its last known state:
+    - a car which is charging or driving is polled every active_interval seconds,
+    - a car whose data changed is polled again after min_interval seconds,
+    - a parked car whose data did not change is polled less and less often, up to max_interval,
+    - some jitter spreads the polls of many cars, so they do not all hit the API at the same time,
+    - with a budget, at most that many cars are polled per budget_period seconds.
+"""
+
+import collections
+import random
+import threading
+import time
+
+from bmwcd.vehiclestate import ChargingState, parse_enum
+
+ACTIVE_INTERVAL = 120       # Poll interval (sec) of a car which is charging or driving
+MIN_INTERVAL = 300          # Poll interval (sec) of a car whose data changed
+MAX_INTERVAL = 3600         # Max poll interval (sec) of a parked car whose data did not change
+BACKOFF = 2.0               # Factor to increase the poll interval with while nothing changes
+JITTER = 0.1                # Random part of the poll interval, 0.1 is +/- 10%
+BUDGET_PERIOD = 3600        # Period (sec) of the request budget
+
+# Fields which change while a car is driving
+DRIVING_FIELDS = ('mileage', 'gps_lat', 'gps_lng')
+parse_charging_status = parse_enum(ChargingState)
+
+
+class AdaptiveScheduler(object):
+    """ Next poll time per VIN, based on the state and changes of the car """
+    def __init__(self, active_interval=ACTIVE_INTERVAL, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 backoff=BACKOFF, jitter=JITTER, budget=None, budget_period=BUDGET_PERIOD):
+        self._lock = threading.Lock()
+        self._next_poll = {}
+        self._intervals = {}
+        self._requests = collections.deque()
+        self.active_interval = active_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.budget = budget
+        self.budget_period = budget_period
+
+    @staticmethod
+    def is_active(car_data, changes=None):
+        """Return True if the car is charging or driving."""
+        if parse_charging_status(car_data.get('charging_status')) is ChargingState.CHARGING:
+            return True
+        return bool(changes) and any(field in changes for field in DRIVING_FIELDS)
+
+    def record(self, vin, car_data=None, changes=None, now=None):
+        """Plan the next poll of a car after it was polled. car_data is None if the poll failed.
+
+        Returns the time (time.monotonic()) of the next poll.
+        """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            interval = self._intervals.get(vin, self.min_interval)
+            if car_data is not None and self.is_active(car_data, changes):
+                interval = self.active_interval
+            elif car_data is not None and changes:
+                interval = self.min_interval
+            else:
+                interval = min(self.max_interval, max(interval, self.min_interval) * self.backoff)
+            self._intervals[vin] = interval
+            interval *= 1 + random.uniform(-self.jitter, self.jitter)
+            self._next_poll[vin] = now + interval
+            return self._next_poll[vin]
+
+    def due(self, vins, now=None):
+        """Return the VINs which should be polled now, the longest overdue first.
+
+        Cars which were never polled are always due. With a budget, only as many cars
+        are returned as the budget still allows and they are counted as requests.
+        """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            due = sorted((self._next_poll.get(vin, 0), vin) for vin in vins if self._next_poll.get(vin, 0) <= now)
+            due = [vin for _, vin in due]
+            if self.budget is not None:
+                while self._requests and self._requests[0] <= now - self.budget_period:
+                    self._requests.popleft()
+                due = due[:max(0, self.budget - len(self._requests))]
+                self._requests.extend([now] * len(due))
+            return due
+
+    def next_poll_time(self, vins):
+        """Return the time (time.monotonic()) at which the first of the cars is due, 0 if one was never polled."""
+        with self._lock:
+            return min((self._next_poll.get(vin, 0) for vin in vins), default=None)
+
+    def forget(self, vin):
+        """Remove a car from the schedule."""
+        with self._lock:
+            self._next_poll.pop(vin, None)
+            self._intervals.pop(vin, None)
@@ -0,0 +1,124 @@
+""" Local store of the remote service history and the charging profile of the cars.
+
+    The history of the remote services of a car only grows, so only the entries which are newer
+    than the high-water mark of the car (the creationTime of its newest entry) are added to the
+    store. The charging profile is kept with its fingerprint (the ETag, or the SHA-256 of the
+    response) so it is only parsed and stored again when it changed.
+
+    Without a path everything is kept in memory, with a path it survives a restart:
+
+        <path>/<VIN>.jsonl      history of a car, one entry per line, oldest first
+        <path>/state.json       high-water mark, ETag and charging profile per VIN
+"""
+
+import json
+import logging
+import os
+import threading
+
+_LOGGER = logging.getLogger(__name__)
+
+TIME_KEY = 'creationTime'   # Time of an entry in the history, as ISO 8601 text so it sorts as a string
+ID_KEY = 'eventId'          # Unique id of an entry in the history
+STATE_FILE = 'state.json'
+
+
+class ServiceHistoryStore(object):
+    """ Incrementally synced remote service history and charging profile per VIN """
+    def __init__(self, path=None):
+        self._lock = threading.Lock()
+        self.path = path
+        self._entries = {}      # VIN -> list of entries, only without a path
+        self._state = {}        # VIN -> {'time', 'ids', 'history_etag', 'profile_fingerprint', 'profile'}
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+            self.load()
+
+    def history_path(self, vin):
+        """Return the file with the history of a car."""
+        return os.path.join(self.path, '{}.jsonl'.format(vin))
+
+    def high_water_mark(self, vin):
+        """Return the creationTime of the newest entry of a car, None if it has no history yet."""
+        return self._state.get(vin, {}).get('time')
+
+    def history_etag(self, vin):
+        """Return the ETag of the last history response of a car."""
+        return self._state.get(vin, {}).get('history_etag')
+
+    def merge(self, vin, entries, etag=None):
+        """Add the entries which are newer than the high-water mark of a car. Returns the new entries."""
+        with self._lock:
+            state = self._state.setdefault(vin, {})
+            mark = state.get('time')
+            seen = set(state.get('ids', ()))
+            new_entries = sorted((entry for entry in entries
+                                  if mark is None or entry.get(TIME_KEY, '') > mark or
+                                  (entry.get(TIME_KEY, '') == mark and entry.get(ID_KEY) not in seen)),
+                                 key=lambda entry: entry.get(TIME_KEY, ''))
+            if new_entries:
+                if self.path is None:
+                    self._entries.setdefault(vin, []).extend(new_entries)
+                else:
+                    with open(self.history_path(vin), 'a') as history_file:
+                        for entry in new_entries:
+                            history_file.write(json.dumps(entry) + '\n')
+                newest = new_entries[-1].get(TIME_KEY, '')
+                if newest != mark:
+                    seen = set()
+                seen.update(entry.get(ID_KEY) for entry in new_entries if entry.get(TIME_KEY, '') == newest)
+                state['time'] = newest
+                state['ids'] = sorted(seen, key=str)
+                _LOGGER.debug("BMW ConnectedDrive API: %s new history entries for %s", len(new_entries), vin)
+            changed_etag = etag is not None and etag != state.get('history_etag')
+            if changed_etag:
+                state['history_etag'] = etag
+            if new_entries or changed_etag:
+                self.save()
+            return new_entries
+
+    def read(self, vin, since=None):
+        """Yield the history of a car, oldest first, only the entries after since (creationTime) if given."""
+        if self.path is None:
+            entries = list(self._entries.get(vin, ()))
+        else:
+            try:
+                with open(self.history_path(vin)) as history_file:
+                    entries = [json.loads(line) for line in history_file if line.strip()]
+            except FileNotFoundError:
+                entries = []
+        for entry in entries:
+            if since is None or entry.get(TIME_KEY, '') > since:
+                yield entry
+
+    def get_profile(self, vin):
+        """Return (fingerprint, charging profile) of a car, (None, None) if it is not known."""
+        state = self._state.get(vin, {})
+        return state.get('profile_fingerprint'), state.get('profile')
+
+    def put_profile(self, vin, fingerprint, profile):
+        """Store the charging profile of a car with its fingerprint."""
+        with self._lock:
+            state = self._state.setdefault(vin, {})
+            state['profile_fingerprint'] = fingerprint
+            state['profile'] = profile
+            self.save()
+
+    def load(self):
+        """Read the state from the path."""
+        try:
+            with open(os.path.join(self.path, STATE_FILE)) as state_file:
+                self._state = json.load(state_file)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as error:
+            _LOGGER.warning("BMW ConnectedDrive API: could not read service history %s: %s", self.path, error)
+
+    def save(self):
+        """Write the state to the path, via a temporary file so it is never half written."""
+        if self.path is None:
+            return
+        state_path = os.path.join(self.path, STATE_FILE)
+        with open(state_path + '.tmp', 'w') as state_file:
+            json.dump(self._state, state_file)
+        os.replace(state_path + '.tmp', state_path)
@@ -0,0 +1,161 @@
+""" OAuth token manager for the BMW ConnectedDrive API.
+
+    Keeps the access token valid for all threads of a ConnectedDrive instance:
+    - concurrent callers which find an expired token wait for a single login,
+    - the token is refreshed in the background shortly before it expires,
+    - the token can be saved to a file, so a restarted process can skip the login,
+    - a token which the API rejects, like a saved one it has forgotten, is dropped.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+REFRESH_MARGIN = 300    # Refresh the token this many seconds before it expires
+RETRY_DELAY = 60        # Retry a background refresh which failed after this many seconds
+
+
+class TokenManager(object):
+    """ Single-flight, proactive refresh of the access token.
+
+        login is a callable which logs in and returns (access token, token lifetime in sec),
+        or None if the credentials were rejected. on_token is called with (access token,
+        expire time) after every change of the token.
+    """
+    def __init__(self, login, on_token=None, path=None, account=None, refresh_margin=REFRESH_MARGIN,
+                 background=True):
+        self._login = login
+        self._on_token = on_token
+        self._lock = threading.Lock()
+        self._timer = None
+        self._timer_lock = threading.Lock()
+        self._stopped = False
+        self._generation = 0
+        self.path = path
+        self.account = account
+        self.refresh_margin = refresh_margin
+        self.background = background
+        self.accesstoken = None
+        self.token_expires = 0
+        self.refresh_count = 0
+        if self.path is not None:
+            self.load()
+
+    def is_valid(self):
+        """Return True if there is a token which has not expired yet."""
+        return self.accesstoken is not None and time.time() < self.token_expires
+
+    def ensure_valid(self):
+        """Return a valid token, log in first if there is none."""
+        generation = self._generation
+        if not self.is_valid():
+            self.refresh(generation)
+        return self.accesstoken
+
+    def refresh(self, generation=None):
+        """Log in and get a new token.
+
+        Only one login runs at a time. If generation is given and another caller has
+        already got a new token since, that token is used instead of logging in again.
+        """
+        if generation is None:
+            generation = self._generation
+        with self._lock:
+            if generation != self._generation and self.is_valid():
+                return self.accesstoken
+            credentials = self._login()
+            self.refresh_count += 1
+            if credentials is None:
+                self.accesstoken, self.token_expires = None, 0
+            else:
+                accesstoken, expires_in = credentials
+                self.accesstoken, self.token_expires = accesstoken, int(time.time()) + expires_in
+            self._generation += 1
+            self.save()
+            self.notify()
+            self.schedule()
+            return self.accesstoken
+
+    def invalidate(self, accesstoken):
+        """Drop the token because the API rejected it, unless another caller has already replaced it."""
+        with self._lock:
+            if accesstoken is not None and accesstoken == self.accesstoken:
+                self.accesstoken, self.token_expires = None, 0
+                self.save()
+
+    def notify(self):
+        """Pass the current token to the on_token callback."""
+        if self._on_token is not None:
+            self._on_token(self.accesstoken, self.token_expires)
+
+    def schedule(self, delay=None):
+        """Start a timer to refresh the token in the background shortly before it expires, or after delay sec."""
+        with self._timer_lock:
+            self.cancel()
+            if not self.background or self.accesstoken is None or self._stopped:
+                return
+            if delay is None:
+                delay = max(0, self.token_expires - self.refresh_margin - time.time())
+            self._timer = threading.Timer(delay, self.refresh_in_background)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def refresh_in_background(self):
+        """Refresh the token from the timer thread."""
+        try:
+            self.refresh()
+            _LOGGER.debug("BMW ConnectedDrive API: token refreshed in the background")
+        except Exception as error: # pylint: disable=broad-except
+            # Keep refreshing in the background, after the wait the API asked for if it did
+            delay = getattr(error, 'retry_after', None) or RETRY_DELAY
+            _LOGGER.error("BMW ConnectedDrive API: token could not be refreshed in the background, retry in %.0f sec: %s",
+                          delay, error)
+            self.schedule(delay)
+
+    def cancel(self):
+        """Cancel the timer of the background refresh."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def stop(self):
+        """Stop the background refresh for good."""
+        with self._timer_lock:
+            self._stopped = True
+            self.cancel()
+
+    def load(self):
+        """Load a saved token, it is only used if it belongs to this account and has not expired yet."""
+        try:
+            with open(self.path) as token_file:
+                token = json.load(token_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as error:
+            _LOGGER.warning("BMW ConnectedDrive API: token file %s could not be read: %s", self.path, error)
+            return
+        if token.get('account') != self.account or token.get('token_expires', 0) <= time.time():
+            return
+        self.accesstoken = token['accesstoken']
+        self.token_expires = token['token_expires']
+        _LOGGER.debug("BMW ConnectedDrive API: token loaded from %s", self.path)
+        self.notify()
+        self.schedule()
+
+    def save(self):
+        """Save the token to the token file, if there is one. The file is only readable by the user."""
+        if self.path is None:
+            return
+        token = {'account': self.account, 'accesstoken': self.accesstoken, 'token_expires': self.token_expires}
+        tmp_path = '{}.tmp'.format(self.path)
+        try:
+            file_descriptor = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(file_descriptor, 'w') as token_file:
+                json.dump(token, token_file)
+            os.replace(tmp_path, self.path)
+        except OSError as error:
+            _LOGGER.warning("BMW ConnectedDrive API: token file %s could not be written: %s", self.path, error)
@@ -0,0 +1,162 @@
+""" Typed, compact state of a car.
+
+    The attributesMap of the API has a string for every value. A VehicleState keeps these
+    strings in a tuple, with the field names in a tuple which is shared by all states with
+    the same fields, and only parses a value to a number, bool, datetime or enum the first
+    time it is read. The parsed value is kept in a slot, so it is parsed only once.
+"""
+
+from datetime import datetime, timezone
+from enum import Enum
+
+_KEYS = {}      # Shared (keys, index of each key) per set of field names
+
+
+class DoorLockState(Enum):
+    """ Door lock state of a car """
+    LOCKED = 'LOCKED'
+    SECURED = 'SECURED'
+    SELECTIVE_LOCKED = 'SELECTIVELOCKED'
+    UNLOCKED = 'UNLOCKED'
+    UNKNOWN = 'UNKNOWN'
+
+
+class ChargingState(Enum):
+    """ Charging state of an electric or hybrid car, the values of charging_status in the attributesMap """
+    CHARGING = 'CHARGINGACTIVE'
+    ENDED = 'CHARGINGENDED'
+    PAUSED = 'CHARGINGPAUSED'
+    ERROR = 'CHARGINGERROR'
+    NOT_CHARGING = 'NOCHARGING'
+    INVALID = 'INVALID'
+    UNKNOWN = 'UNKNOWN'
+
+    @classmethod
+    def _missing_(cls, value):
+        """Also accept the names of the charging states of the vehicle status API."""
+        name = CHARGING_STATE_ALIASES.get(value)
+        return cls[name] if name is not None else None
+
+
+# Charging states of the vehicle status API with the ChargingState they are the same as
+CHARGING_STATE_ALIASES = {
+    'CHARGING': 'CHARGING',
+    'ERROR': 'ERROR',
+    'FINISHED_FULLY_CHARGED': 'ENDED',
+    'FINISHED_NOT_FULL': 'ENDED',
+    'NOT_CHARGING': 'NOT_CHARGING',
+    'WAITING_FOR_CHARGING': 'PAUSED',
+}
+
+
+def parse_int(value):
+    """Parse an integer, also when it is written as a float."""
+    return int(float(value))
+
+
+def parse_bool(true_value):
+    """Return a parser which is True if the value equals true_value."""
+    def parse(value):
+        return value == true_value
+    return parse
+
+
+def parse_enum(enum):
+    """Return a parser to an enum, values which are not known become UNKNOWN."""
+    def parse(value):
+        try:
+            return enum(value)
+        except ValueError:
+            return enum.UNKNOWN
+    return parse
+
+
+def parse_timestamp(value):
+    """Parse a timestamp in milliseconds since epoch to a datetime in UTC."""
+    return datetime.fromtimestamp(int(value) / 1000, tz=timezone.utc)
+
+
+class LazyField(object):
+    """ Descriptor which parses a field of the attributesMap on first access and memoizes it """
+    def __init__(self, keys, parser):
+        self.keys = keys if isinstance(keys, tuple) else (keys,)
+        self.parser = parser
+        self.slot = None
+
+    def __set_name__(self, owner, name):
+        self.slot = '_' + name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        try:
+            return getattr(instance, self.slot)
+        except AttributeError:
+            pass
+        value = None
+        for key in self.keys:
+            raw_value = instance.get_raw(key)
+            if raw_value is not None and raw_value != '':
+                try:
+                    value = self.parser(raw_value)
+                except (TypeError, ValueError):
+                    value = None
+                break
+        setattr(instance, self.slot, value)
+        return value
+
+
+class VehicleState(object):
+    """ State of a car from its attributesMap, the values are parsed when they are read.
+
+        The strings from the API are available with get_raw(key) and as a dict with the raw
+        property, which is only built when it is asked for.
+    """
+    __slots__ = ('_keys', '_index', '_values', 'vin', 'car_name', 'type_of_car',
+                 '_mileage', '_remaining_fuel', '_remaining_range_fuel', '_remaining_range_electric',
+                 '_charging_level_hv', '_gps_lat', '_gps_lng', '_update_time', '_door_lock_state',
+                 '_charging_status', '_connector_connected', '_lights_parking_on')
+
+    mileage = LazyField('mileage', parse_int)
+    remaining_fuel = LazyField('remaining_fuel', float)
+    remaining_range_fuel = LazyField(('beRemainingRangeFuelKm', 'beRemainingRangeFuel'), float)
+    remaining_range_electric = LazyField(('beRemainingRangeElectricKm', 'beRemainingRangeElectric'), float)
+    charging_level_hv = LazyField('chargingLevelHv', float)
+    gps_lat = LazyField('gps_lat', float)
+    gps_lng = LazyField('gps_lng', float)
+    update_time = LazyField('updateTime_converted_timestamp', parse_timestamp)
+    door_lock_state = LazyField('door_lock_state', parse_enum(DoorLockState))
+    charging_status = LazyField('charging_status', parse_enum(ChargingState))
+    connector_connected = LazyField('connectorStatus', parse_bool('CONNECTED'))
+    lights_parking_on = LazyField('lights_parking', parse_bool('ON'))
+
+    def __init__(self, attributes, vin=None, car_name=None, type_of_car=None):
+        keys = tuple(attributes)
+        shared = _KEYS.get(keys)
+        if shared is None:
+            shared = _KEYS.setdefault(keys, (keys, {key: i for i, key in enumerate(keys)}))
+        self._keys, self._index = shared
+        self._values = tuple(attributes.values())
+        self.vin = vin
+        self.car_name = car_name
+        self.type_of_car = type_of_car
+
+    @classmethod
+    def from_car_data(cls, car_data):
+        """Make a state of the car data from ConnectedDrive.update(), with the added VIN, name and type."""
+        attributes = {key: value for key, value in car_data.items()
+                      if key not in ('vin', 'car_name', 'type_of_car')}
+        return cls(attributes, car_data.get('vin'), car_data.get('car_name'), car_data.get('type_of_car'))
+
+    def get_raw(self, key, default=None):
+        """Return the string from the API of a field."""
+        i = self._index.get(key)
+        return default if i is None else self._values[i]
+
+    @property
+    def raw(self):
+        """Return the attributesMap as a new dict."""
+        return dict(zip(self._keys, self._values))
+
+    def __repr__(self):
+        return '<VehicleState {} {}>'.format(self.vin, self.car_name)
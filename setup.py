@@ -18,6 +18,10 @@ setup(name='bmwcd',
       version='0.1.0',
       description=open(os.path.join(CURRENT_DIR, 'README.md')).read(),
       install_requires=['requests'],
+      extras_require={
+          'async': ['aiohttp'],
+          'history': ['numpy'],
+      },
       maintainer='Gerard',
       maintainer_email='mail@mail.mail',
       zip_safe=False,
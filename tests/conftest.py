@@ -0,0 +1,43 @@
+""" Shared fixtures of the tests """
+
+import pytest
+
+import bmwcd.bmwcdapi
+from bmwcd.bmwcdapi import ConnectedDrive
+from bmwcd.mockserver import MockServer
+
+
+@pytest.fixture(autouse=True)
+def no_retry_wait(monkeypatch):
+    """Retry a failed request at once instead of after the backoff, also in the async client."""
+    monkeypatch.setattr(bmwcd.bmwcdapi, 'RETRY_BACKOFF', 0)
+    try:
+        from bmwcd import bmwcdapi_async # pylint: disable=import-outside-toplevel
+    except ImportError:         # aiohttp is optional
+        return
+    monkeypatch.setattr(bmwcdapi_async, 'RETRY_BACKOFF', 0)
+
+
+@pytest.fixture
+def server():
+    """A mock ConnectedDrive API with 3 cars."""
+    with MockServer(vehicles=3) as mock_server:
+        yield mock_server
+
+
+@pytest.fixture
+def connect(server):
+    """Return a function which makes a lazy ConnectedDrive on the mock server, it is closed after the test."""
+    accounts = []
+
+    def make(username='user', **kwargs):
+        kwargs.setdefault('url', server.url)
+        kwargs.setdefault('auth_url', server.auth_url)
+        kwargs.setdefault('background_refresh', False)
+        account = ConnectedDrive(username, 'password', lazy=True, rate_limiter=False, **kwargs)
+        accounts.append(account)
+        return account
+
+    yield make
+    for account in accounts:
+        account.close()
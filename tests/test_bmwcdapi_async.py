@@ -0,0 +1,137 @@
+""" Tests of AsyncConnectedDrive against the local mock server """
+
+import asyncio
+import functools
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+import bmwcd.bmwcdapi_async # pylint: disable=wrong-import-position
+from bmwcd.Exceptions import BMWConnectedDriveException
+from bmwcd.bmwcdapi_async import AsyncConnectedDrive
+from bmwcd.mockserver import make_vin
+from bmwcd.ratelimit import TokenBucket
+from bmwcd.remoteservices import poll_intervals
+
+
+def run(server, test, **kwargs):
+    """Run test(bmw) with a started AsyncConnectedDrive on the mock server."""
+    kwargs.setdefault('rate_limiter', False)
+
+    async def main():
+        async with AsyncConnectedDrive('user', 'password', url=server.url, auth_url=server.auth_url,
+                                       **kwargs) as bmw:
+            return await test(bmw)
+    return asyncio.run(main())
+
+
+def test_start_and_update(server):
+    async def test(bmw):
+        assert [car['vin'] for car in bmw.cars] == [make_vin(0), make_vin(1), make_vin(2)]
+        assert [car_data['vin'] for car_data in bmw.cars_data] == [make_vin(0), make_vin(1), make_vin(2)]
+        assert bmw.cars_data[0]['car_name'] == 'BMW i3 94 (+ REX)'
+        assert await bmw.update() is None   # The update interval has not passed yet
+
+    run(server, test)
+    assert server.backend.requests['authenticate'] == 1
+    assert server.backend.requests['dynamic'] == 3
+
+
+def test_partial_update(server):
+    server.backend.failures[make_vin(1)] = 500
+
+    async def test(bmw):
+        assert [car_data['vin'] for car_data in bmw.cars_data] == [make_vin(0), make_vin(2)]
+        assert bmw.update_errors == {make_vin(1): 500}
+
+    run(server, test)
+
+
+def test_iter_updates(server):
+    server.backend.failures[make_vin(2)] = 500
+
+    async def test(bmw):
+        updates = {update.vin: update async for update in bmw.iter_updates()}
+        assert updates[make_vin(0)].car_data['mileage'] == '1000'
+        assert updates[make_vin(2)].car_data is None
+        assert updates[make_vin(2)].error == 500
+        assert [update.vin async for update in bmw.iter_updates([make_vin(1)])] == [make_vin(1)]
+
+    run(server, test, max_workers=2)
+
+
+def test_get_vehicle_profile(server):
+    async def test(bmw):
+        requests = server.backend.requests['dynamic']
+        profile = await bmw.get_vehicle_profile(make_vin(0))
+        assert server.backend.requests['dynamic'] == requests + 1
+        assert profile.data['car_data']['mileage'] == '1000'
+        assert profile.data['service_partner']['name'] == 'Mock BMW dealer'
+        assert not profile.errors
+
+    run(server, test)
+
+
+def test_execute_service(server, monkeypatch):
+    monkeypatch.setattr(bmwcd.bmwcdapi_async, 'poll_intervals', functools.partial(poll_intervals, first=0.01))
+
+    async def test(bmw):
+        assert await bmw.execute_service('lock', make_vin(0))
+        assert await bmw.execute_service_many('light', [make_vin(1), make_vin(2)]) == {
+            make_vin(1): True, make_vin(2): True}
+
+    run(server, test)
+    assert server.backend.executions[make_vin(0)][0] == 'RDL'
+
+
+def test_car_list_error(server):
+    async def test(bmw):
+        server.backend.error_rate = 1.0
+        assert await bmw.get_cars() == 500
+        assert len(bmw.cars) == 3   # The list of cars is kept
+
+    run(server, test)
+
+
+def test_login_error(server):
+    server.backend.error_rate = 1.0
+    with pytest.raises(BMWConnectedDriveException) as error:
+        run(server, None)
+    assert error.value.code == 500
+
+
+def test_retry(server):
+    server.backend.failures[make_vin(1)] = 500
+
+    async def test(bmw):
+        assert bmw.update_errors == {make_vin(1): 500}
+
+    run(server, test)
+    assert server.backend.requests['dynamic'] == 3 + 2     # The failing car is retried twice
+
+
+def test_circuit_breaker(server):
+    server.backend.failures[make_vin(0)] = 503
+
+    async def test(bmw):
+        # The first car opens the circuit of the host, the other cars are not sent anymore
+        assert bmw.update_errors == {make_vin(0): 503, make_vin(1): 503, make_vin(2): 503}
+        assert server.backend.requests['dynamic'] == 1
+        bmw.last_update_time = 0
+        await bmw.update()
+        assert server.backend.requests['dynamic'] == 1
+        with pytest.raises(BMWConnectedDriveException):
+            await bmw.execute_service('lock', make_vin(0))
+
+    run(server, test, max_workers=1)
+
+
+def test_shared_rate_limiter(server):
+    bucket = TokenBucket(rate=0.001, burst=100)
+
+    async def test(bmw):
+        assert bmw.rate_limiter is bucket
+
+    run(server, test, rate_limiter=bucket)
+    assert bucket.tokens < 100 - 4     # Login, list of cars and 3 cars
@@ -0,0 +1,59 @@
+""" Tests of the response cache """
+
+from bmwcd.cache import ResponseCache
+from bmwcd.metrics import Metrics
+from bmwcd.mockserver import make_vin
+
+
+def test_make_key():
+    assert ResponseCache.make_key('specs', 'VIN', 'a=1', account='user') == 'specs|VIN|a=1'
+    assert ResponseCache.make_key('get_cars', account='one') != ResponseCache.make_key('get_cars', account='two')
+
+
+def test_fresh_stale_and_revalidated():
+    cache = ResponseCache()
+    cache.put('key', {'value': 1}, 3600, etag='"1"')
+    payload = cache.get_fresh('key')
+    payload['value'] = 2            # A copy, the cache is not changed
+    assert cache.get_fresh('key') == {'value': 1}
+    cache.put('key', {'value': 1}, -1, etag='"1"')
+    assert cache.get_fresh('key') is None
+    assert cache.conditional_headers(cache.get('key')) == {'If-None-Match': '"1"'}
+    assert cache.revalidated('key', 3600) == {'value': 1}
+    assert cache.get_fresh('key') == {'value': 1}
+
+
+def test_least_recently_used_and_path(tmp_path):
+    path = str(tmp_path / 'cache.json')
+    cache = ResponseCache(max_entries=2, path=path)
+    cache.put('a', 1, 3600)
+    cache.put('b', 2, 3600)
+    cache.get('a')
+    cache.put('c', 3, 3600)
+    assert cache.get('b') is None
+    assert ResponseCache(path=path).get_fresh('a') == 1
+
+
+def test_cache_revalidation(server, connect):
+    metrics = Metrics()
+    bmw = connect(cache=ResponseCache(ttls={'specs': 3600}), metrics=metrics)
+    bmw.start()
+    vin = make_vin(0)
+    specs = bmw.request_car_data('specs', vin=vin)
+    assert bmw.request_car_data('specs', vin=vin) == specs
+    assert server.backend.requests['specs'] == 1
+    bmw.cache.revalidated(bmw.cache.make_key('specs', vin), 0)  # Let the entry expire
+    assert bmw.request_car_data('specs', vin=vin) == specs
+    assert server.backend.requests['specs'] == 2
+    assert metrics.get_count('cache_requests_total', data_type='specs', result='miss') == 1
+    assert metrics.get_count('cache_requests_total', data_type='specs', result='hit') == 1
+    assert metrics.get_count('cache_requests_total', data_type='specs', result='revalidated') == 1
+
+
+def test_shared_cache_per_account(server, connect):
+    cache = ResponseCache()
+    connect('one', cache=cache).start()
+    connect('two', cache=cache).start()
+    assert server.backend.requests['vehicles'] == 2     # The cars of one account are not used for the other
+    connect('one', cache=cache).start()
+    assert server.backend.requests['vehicles'] == 2
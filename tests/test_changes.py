@@ -0,0 +1,55 @@
+""" Tests of the change detection """
+
+from bmwcd.changes import ChangeTracker, compute_delta
+
+
+def test_compute_delta():
+    assert compute_delta(None, {'a': 1}) == {'a': (None, 1)}
+    assert compute_delta({'a': 1, 'b': 2}, {'a': 1, 'c': 3}) == {'b': (2, None), 'c': (None, 3)}
+    assert compute_delta({'a': 1}, {'a': 1}) == {}
+
+
+def test_subscribers_by_vin_and_field():
+    tracker = ChangeTracker()
+    calls = {'all': [], 'vin': [], 'field': []}
+    tracker.subscribe(lambda vin, changes: calls['all'].append((vin, changes)))
+    tracker.subscribe(lambda vin, changes: calls['vin'].append((vin, changes)), vin='A')
+    tracker.subscribe(lambda vin, changes: calls['field'].append((vin, changes)), field='mileage')
+
+    tracker.process('A', {'mileage': '10', 'door_lock_state': 'SECURED'})
+    tracker.process('B', {'mileage': '20'})
+    for calls_of in calls.values():
+        del calls_of[:]
+
+    tracker.process('A', {'mileage': '10', 'door_lock_state': 'UNLOCKED'})  # Only a field without a subscriber
+    tracker.process('B', {'mileage': '20'})                                 # Nothing changed
+    assert calls['all'] == [('A', {'door_lock_state': ('SECURED', 'UNLOCKED')})]
+    assert calls['vin'] == calls['all']
+    assert calls['field'] == []
+
+    tracker.process('B', {'mileage': '25'})
+    assert calls['field'] == [('B', {'mileage': ('20', '25')})]
+    assert len(calls['vin']) == 1
+
+
+def test_unsubscribe_and_failing_callback():
+    tracker = ChangeTracker()
+    calls = []
+
+    def fail(vin, changes):
+        raise ValueError('callback error')
+
+    tracker.subscribe(fail)
+    unsubscribe = tracker.subscribe(lambda vin, changes: calls.append(vin))
+    tracker.process('A', {'mileage': '10'})     # A failing callback does not stop the others
+    unsubscribe()
+    unsubscribe()
+    tracker.process('A', {'mileage': '11'})
+    assert calls == ['A']
+
+
+def test_forget():
+    tracker = ChangeTracker()
+    tracker.process('A', {'mileage': '10'})
+    tracker.forget('A')
+    assert tracker.process('A', {'mileage': '10'}) == {'mileage': (None, '10')}
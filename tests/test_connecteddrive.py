@@ -0,0 +1,117 @@
+""" Tests of ConnectedDrive against the local mock server """
+
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from bmwcd.mockserver import MockServer, make_vin
+
+
+def vins(cars_data):
+    return [car_data['vin'] for car_data in cars_data]
+
+
+def test_serial_update(connect):
+    bmw = connect()
+    cars_data = bmw.update()
+    assert vins(cars_data) == [make_vin(0), make_vin(1), make_vin(2)]
+    assert cars_data[0]['mileage'] == '1000'
+    assert cars_data[0]['car_name'] == 'BMW i3 94 (+ REX)'
+    assert bmw.update() is None     # The update interval has not passed yet
+
+
+def test_parallel_update(server, connect):
+    bmw = connect(parallel=True, max_workers=3)
+    assert vins(bmw.update()) == [make_vin(0), make_vin(1), make_vin(2)]
+    assert server.backend.requests['dynamic'] == 3
+    assert not bmw.update_errors
+
+
+def test_parallel_partial_update(server, connect):
+    server.backend.failures[make_vin(1)] = 500
+    bmw = connect(parallel=True, max_workers=3)
+    assert vins(bmw.update()) == [make_vin(0), make_vin(2)]
+    assert dict(bmw.update_errors) == {make_vin(1): 500}
+
+
+def test_run_as_script(tmp_path):
+    # Without the package on the path, like python bmwcd/bmwcdapi.py
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bmwcd', 'bmwcdapi.py')
+    code = 'import runpy; runpy.run_path({!r}, run_name="script")'.format(script)
+    env = {key: value for key, value in os.environ.items() if key != 'PYTHONPATH'}
+    subprocess.run([sys.executable, '-c', code], cwd=str(tmp_path), env=env, check=True)
+
+
+def test_iter_updates(server, connect, capsys):
+    server.backend.failures[make_vin(2)] = 500
+    bmw = connect(parallel=True, max_workers=2)
+    updates = {update.vin: update for update in bmw.iter_updates()}
+    assert sorted(updates) == [make_vin(0), make_vin(1), make_vin(2)]
+    assert updates[make_vin(0)].car_data['mileage'] == '1000'
+    assert updates[make_vin(2)].car_data is None
+    assert updates[make_vin(2)].error == 500
+    assert [update.vin for update in bmw.iter_updates([make_vin(1)])] == [make_vin(1)]
+    assert bmw.cars_data == ()      # The snapshot of update() is left as it is
+    assert capsys.readouterr().out == ''
+
+
+def test_iter_updates_stop_early(connect):
+    with MockServer(vehicles=6, latency=0.05) as server:
+        bmw = connect(url=server.url, auth_url=server.auth_url, parallel=True, max_workers=2)
+        bmw.start()
+        for update in bmw.iter_updates():
+            break
+        time.sleep(0.3)
+        assert server.backend.requests['dynamic'] <= 3  # The cars after the first ones are never fetched
+
+        bmw.parallel = False
+        for update in bmw.iter_updates():
+            break
+        time.sleep(0.1)
+        assert server.backend.requests['dynamic'] <= 4
+
+
+def test_get_vehicle_profile(server, connect):
+    server.backend.failures['navigation'] = 404
+    bmw = connect()
+    bmw.start()
+    profile = bmw.get_vehicle_profile(make_vin(0))
+    assert server.backend.requests['dynamic'] == 1     # For both car_data and car_data_service
+    assert profile.data['car_data']['mileage'] == '1000'
+    assert profile.data['car_data_service']['cbsMessages'][0]['status'] == 'OK'
+    assert profile.data['service_partner']['name'] == 'Mock BMW dealer'
+    assert profile.errors == {'navigation': 404}
+    assert 'navigation' not in profile.data
+
+    profile = bmw.get_vehicle_profile(make_vin(1), parts=['efficiency'])
+    assert list(profile.data) == ['efficiency']
+    assert server.backend.requests['dynamic'] == 1
+
+
+def test_snapshot_is_read_only(connect):
+    bmw = connect()
+    bmw.update()
+    with pytest.raises(TypeError):
+        bmw.cars_data[0]['mileage'] = '0'
+    with pytest.raises(TypeError):
+        bmw.update_errors['VIN'] = 500
+    assert dict(bmw.cars_data[0])['mileage'] == '1000'
+
+
+def test_snapshot_during_update(server, connect):
+    bmw = connect(parallel=True, max_workers=3)
+    bmw.update()
+    snapshot = bmw.snapshot
+    server.backend.latency = 0.2
+    updater = threading.Thread(target=bmw.update, kwargs={'force': True})
+    updater.start()
+    time.sleep(0.1)
+    assert bmw.snapshot is snapshot     # Readers see the previous complete update, without waiting
+    assert len(bmw.cars_data) == 3
+    updater.join()
+    assert bmw.snapshot is not snapshot
+    assert bmw.last_update_time > snapshot.time
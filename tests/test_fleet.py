@@ -0,0 +1,54 @@
+""" Tests of the fleet of accounts against the local mock server """
+
+from bmwcd.Exceptions import BMWConnectedDriveException
+from bmwcd.fleet import Fleet
+from bmwcd.mockserver import MockServer, make_vin
+from bmwcd.scheduler import AdaptiveScheduler
+
+
+def add_account(fleet, name, server, **kwargs):
+    return fleet.add_account(name, name, 'password', url=server.url, auth_url=server.auth_url,
+                             rate_limiter=False, **kwargs)
+
+
+def test_poll_accounts(server):
+    fleet = Fleet(max_workers=4, account_max_workers=2)
+    add_account(fleet, 'good', server)
+    vehicles = fleet.poll()
+    assert sorted(vehicles) == [make_vin(0), make_vin(1), make_vin(2)]
+    assert [car_data['vin'] for car_data in fleet.get_vehicles('good')] == [make_vin(0), make_vin(1), make_vin(2)]
+    assert server.backend.requests['dynamic'] == 3
+    assert not fleet.errors
+    fleet.close()
+
+
+def test_failing_account_and_car(server):
+    with MockServer(vehicles=1, error_rate=1.0) as broken:
+        server.backend.failures[make_vin(2)] = 500
+        fleet = Fleet(max_workers=4)
+        add_account(fleet, 'good', server)
+        add_account(fleet, 'bad', broken)
+        vehicles = fleet.poll()     # One failing account never fails the whole poll
+        assert sorted(vehicles) == [make_vin(0), make_vin(1)]
+        assert isinstance(fleet.errors['bad'], BMWConnectedDriveException)
+        assert fleet.errors[make_vin(2)] == 500
+        fleet.close()
+
+
+def test_remove_account(server):
+    fleet = Fleet()
+    add_account(fleet, 'good', server)
+    fleet.poll()
+    fleet.remove_account('good')
+    assert fleet.get_vehicles() == []
+    assert fleet.poll() == {}
+    fleet.close()
+
+
+def test_poll_with_scheduler(server):
+    fleet = Fleet(scheduler=AdaptiveScheduler(jitter=0))
+    add_account(fleet, 'good', server)
+    assert len(fleet.poll()) == 3
+    assert len(fleet.poll()) == 3   # No car is due, the data is kept
+    assert server.backend.requests['dynamic'] == 3
+    fleet.close()
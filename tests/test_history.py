@@ -0,0 +1,61 @@
+""" Tests of the on-disk history of the cars """
+
+import math
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from bmwcd.history import HistoryStore, TIME_COLUMN # pylint: disable=wrong-import-position
+
+
+def fill(store, vin='V', times=(100, 200, 300, 400)):
+    for number, timestamp in enumerate(times):
+        store.append(vin, {'mileage': str(1000 + number), 'gps_lat': 'not a number'}, timestamp)
+
+
+def test_append_and_query(tmp_path):
+    store = HistoryStore(str(tmp_path), fields=('mileage', 'gps_lat'))
+    fill(store)
+    assert not store.append('V', {'mileage': '0'}, 400)    # Not newer than the last snapshot
+    data = store.query('V', start=200, end=300)
+    assert list(data[TIME_COLUMN]) == [200, 300]
+    assert list(data['mileage']) == [1001, 1002]
+    assert math.isnan(data['gps_lat'][0])
+    assert store.vins() == ['V']
+
+
+def test_reopen(tmp_path):
+    fill(HistoryStore(str(tmp_path), fields=('mileage',)))
+    store = HistoryStore(str(tmp_path), fields=('other',))
+    assert not store.append('V', {'mileage': '0'}, 400)
+    assert store.append('V', {'mileage': '1004'}, 500)
+    assert store.get_fields('V') == ('mileage',)     # The fields of a car are fixed
+    assert list(store.query('V')['mileage']) == [1000, 1001, 1002, 1003, 1004]
+
+
+def test_downsample(tmp_path):
+    store = HistoryStore(str(tmp_path), fields=('mileage',))
+    fill(store, times=(0, 10, 60, 70, 200))
+    starts, means = store.downsample('V', 'mileage', 60)
+    assert list(starts) == [0, 60, 180]
+    assert list(means) == [1000.5, 1002.5, 1004]
+
+
+def test_compact(tmp_path):
+    store = HistoryStore(str(tmp_path), fields=('mileage',))
+    fill(store)
+    assert store.compact('V', retention=150, now=400) == 2
+    assert store.compact('V', retention=150, now=400) == 0
+    assert store.append('V', {'mileage': '1004'}, 500)
+    assert list(store.query('V')[TIME_COLUMN]) == [300, 400, 500]
+    assert list(store.query('V')['mileage']) == [1002, 1003, 1004]
+
+
+def test_compact_before_append(tmp_path):
+    fill(HistoryStore(str(tmp_path), fields=('mileage',)))
+    store = HistoryStore(str(tmp_path), fields=('mileage',))   # Like a maintenance job in a new process
+    assert store.compact('V', retention=150, now=400) == 2
+    assert not store.append('V', {'mileage': '0'}, 400)
+    assert store.append('V', {'mileage': '1004'}, 500)
+    assert list(store.query('V')['mileage']) == [1002, 1003, 1004]
@@ -0,0 +1,71 @@
+""" Tests of the on-disk cache of the render images """
+
+import os
+import time
+
+from bmwcd.imagecache import ImageCache, IMAGE_DIR, TMP_MAX_AGE
+from bmwcd.mockserver import IMAGE_PNG, make_vin
+
+
+def test_put_get_and_dedupe(tmp_path):
+    cache = ImageCache(str(tmp_path))
+    first = cache.put('A_0_780', [b'png', b'data'])
+    second = cache.put('B_0_780', [b'pngdata'])
+    assert first == second
+    assert cache.get('A_0_780') == first
+    assert cache.total_bytes == 7
+    assert cache.get('C_0_780') is None
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=250)
+    for i in range(3):
+        cache.put('key{}'.format(i), [bytes([i]) * 100])
+    assert cache.get('key0') is None
+    assert cache.get('key2') is not None
+    assert cache.total_bytes <= 250
+
+
+def test_load_keeps_files_it_does_not_own(tmp_path):
+    (tmp_path / 'photo.png').write_bytes(b'user file')
+    (tmp_path / 'notes.tmp').write_bytes(b'user file')
+    cache = ImageCache(str(tmp_path))
+    image_path = cache.put('A_0_780', [b'image'])
+    image_dir = tmp_path / IMAGE_DIR
+    running = image_dir / 'download-running.tmp'
+    running.write_bytes(b'partial')
+    left_over = image_dir / 'download-old.tmp'
+    left_over.write_bytes(b'partial')
+    os.utime(left_over, (time.time() - TMP_MAX_AGE - 1,) * 2)
+    unknown = image_dir / ('0' * 64 + '.png')
+    unknown.write_bytes(b'not in the index')
+
+    cache = ImageCache(str(tmp_path))
+    assert cache.get('A_0_780') == image_path
+    assert (tmp_path / 'photo.png').exists()
+    assert (tmp_path / 'notes.tmp').exists()
+    assert running.exists()
+    assert not left_over.exists()
+    assert not unknown.exists()
+
+
+def test_get_car_image(server, connect):
+    bmw = connect()
+    bmw.start()
+    image_path = bmw.get_car_image(make_vin(0))
+    assert bmw.get_car_image(make_vin(0)) == image_path
+    assert bytes(bmw.get_car_image(make_vin(0), as_mmap=True)) == IMAGE_PNG
+    assert server.backend.requests['image'] == 1     # The same key is downloaded only once
+    assert bmw.get_car_image(make_vin(0), angle=10) == image_path   # The same render is stored once
+    assert server.backend.requests['image'] == 2
+    assert bmw.get_car_image('UNKNOWN') == 404
+    bmw.close()
+    assert not os.path.exists(image_path)    # The temporary image cache is removed
+
+
+def test_get_car_image_given_cache(tmp_path, connect):
+    bmw = connect(image_cache=str(tmp_path))
+    bmw.start()
+    image_path = bmw.get_car_image(make_vin(0))
+    bmw.close()
+    assert os.path.exists(image_path)
@@ -0,0 +1,50 @@
+""" Tests of the mock ConnectedDrive API """
+
+import requests
+
+from bmwcd.mockserver import make_vin
+
+
+def login(server, password='password'):
+    response = requests.post(server.auth_url, data={'username': 'user', 'password': password},
+                             allow_redirects=False)
+    assert response.status_code == 302
+    return response.headers['Location']
+
+
+def get(server, path, token, **headers):
+    headers['Authorization'] = 'Bearer ' + token
+    return requests.get(server.url + path, headers=headers)
+
+
+def token_of(location):
+    return location.split('access_token=')[1].split('&')[0]
+
+
+def test_login_and_token(server):
+    token = token_of(login(server))
+    assert get(server, '/api/me/vehicles/v2', token).json()[0]['vin'] == make_vin(0)
+    assert get(server, '/api/me/vehicles/v2', 'wrong').status_code == 401
+
+
+def test_wrong_password(server):
+    server.backend.username, server.backend.password = 'user', 'secret'
+    assert 'error=access_denied' in login(server)
+    assert 'access_token=' in login(server, 'secret')
+
+
+def test_failures_per_vin(server):
+    token = token_of(login(server))
+    server.backend.failures[make_vin(1)] = 503
+    assert get(server, '/api/vehicle/dynamic/v1/{}'.format(make_vin(0)), token).status_code == 200
+    assert get(server, '/api/vehicle/dynamic/v1/{}'.format(make_vin(1)), token).status_code == 503
+    assert get(server, '/api/vehicle/dynamic/v1/UNKNOWN', token).status_code == 404
+    assert server.backend.requests['dynamic'] == 2
+
+
+def test_etag(server):
+    token = token_of(login(server))
+    path = '/api/vehicle/specs/v1/{}'.format(make_vin(0))
+    etag = get(server, path, token).headers['ETag']
+    assert get(server, path, token, **{'If-None-Match': etag}).status_code == 304
+    assert get(server, path, token, **{'If-None-Match': '"other"'}).status_code == 200
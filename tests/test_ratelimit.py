@@ -0,0 +1,76 @@
+""" Tests of the rate limiter and the circuit breaker """
+
+import asyncio
+
+import pytest
+
+from bmwcd.Exceptions import BMWConnectedDriveException
+from bmwcd.mockserver import make_vin
+from bmwcd.ratelimit import CircuitBreaker, TokenBucket, parse_retry_after
+
+
+def test_open_and_close():
+    breaker = CircuitBreaker('test', failure_threshold=2)
+    assert breaker.record_failure(500) == 0
+    assert breaker.record_failure(500) == breaker.reset_timeout
+    with pytest.raises(BMWConnectedDriveException) as error:
+        breaker.before_request()
+    assert error.value.code == 500
+    breaker.open_until = 0          # The reset timeout has passed
+    breaker.before_request()
+    breaker.record_success()
+    assert breaker.code is None
+
+
+def test_late_success_keeps_circuit_open():
+    breaker = CircuitBreaker('test')
+    assert breaker.record_failure(429, retry_after=30) == 30
+    breaker.record_success()        # Answer to a request which was sent before the circuit opened
+    with pytest.raises(BMWConnectedDriveException):
+        breaker.before_request()
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('120') == 120.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=100, burst=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert 0 < bucket.reserve() <= 0.01
+    bucket.acquire()
+    asyncio.run(bucket.acquire_async())
+
+
+def test_login_error(server, connect):
+    server.backend.error_rate = 1.0
+    bmw = connect()
+    with pytest.raises(BMWConnectedDriveException) as error:
+        bmw.update()
+    assert error.value.code == 500
+
+
+def test_circuit_breaker_serial(server, connect):
+    server.backend.failures[make_vin(0)] = 503
+    bmw = connect()
+    assert bmw.update() is None     # The car fails and opens the circuit of the host
+    requests = server.backend.requests['dynamic']
+    with pytest.raises(BMWConnectedDriveException) as error:
+        bmw.update(force=True)
+    assert error.value.code == 503
+    assert error.value.retry_after > 0
+    assert server.backend.requests['dynamic'] == requests   # Nothing is sent while the circuit is open
+
+
+def test_circuit_breaker_parallel(server, connect):
+    bmw = connect(parallel=True, max_workers=3)
+    bmw.start()
+    server.backend.failures[make_vin(0)] = 429
+    bmw.update()
+    requests = server.backend.requests['dynamic']
+    bmw.update(force=True)
+    assert dict(bmw.update_errors) == {make_vin(0): 429, make_vin(1): 429, make_vin(2): 429}
+    assert server.backend.requests['dynamic'] == requests
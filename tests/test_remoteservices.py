@@ -0,0 +1,93 @@
+""" Tests of the polling of remote services """
+
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from bmwcd.mockserver import make_vin
+from bmwcd.remoteservices import ServicePoller, poll_intervals
+
+
+def poller(states, **intervals):
+    """Return a ServicePoller with fast polls, its checks answer states one after another."""
+    checks = []
+
+    def check_state(url_check):
+        checks.append(url_check)
+        state = states[min(len(checks), len(states)) - 1]
+        if isinstance(state, Exception):
+            raise state
+        return state
+
+    intervals.setdefault('first', 0.01)
+    return ServicePoller(check_state, **intervals), checks
+
+
+def test_poll_intervals():
+    assert list(poll_intervals(first=2, factor=1.5, maximum=5, timeout=12)) == [2, 3, 4.5, 2.5]
+    assert list(poll_intervals(first=4, factor=2, maximum=5, timeout=14)) == [4, 5, 5]
+
+
+def test_executed_after_backoff():
+    service_poller, checks = poller(['PENDING', 'PENDING', 'EXECUTED'])
+    future = Future()
+    service_poller.add('lock', 'url', future)
+    assert future.result(5) is True
+    assert len(checks) == 3
+    service_poller.stop()
+
+
+def test_timeout_gives_false():
+    service_poller, checks = poller(['PENDING'], timeout=0.05)
+    future = Future()
+    service_poller.add('lock', 'url', future)
+    assert future.result(5) is False
+    assert len(checks) > 1
+    service_poller.stop()
+
+
+def test_exception_reaches_future():
+    service_poller, _ = poller([ValueError('no XML')])
+    future = Future()
+    service_poller.add('lock', 'url', future)
+    with pytest.raises(ValueError):
+        future.result(5)
+    service_poller.stop()
+
+
+def test_cancel_stops_polling():
+    service_poller, checks = poller(['PENDING'], first=0.05)
+    future = Future()
+    service_poller.add('lock', 'url', future)
+    assert future.cancel()
+    time.sleep(0.2)
+    assert not checks
+    service_poller.stop()
+
+
+def test_stop_resolves_pending():
+    service_poller, checks = poller(['PENDING'], first=60)
+    future = Future()
+    service_poller.add('lock', 'url', future)
+    service_poller.stop()
+    assert future.result(0) is False
+    assert not checks
+    with pytest.raises(RuntimeError):
+        service_poller.add('lock', 'url', Future())
+    assert not any(thread.name == 'bmwcd-service-poller' for thread in threading.enumerate())
+
+
+def test_execute_service(server, connect):
+    bmw = connect()
+    bmw.start()
+    bmw.service_poller.intervals.update(first=0.01)
+    assert bmw.execute_service('lock', make_vin(0))
+    futures = bmw.execute_service_many('light', [make_vin(1), make_vin(2)])
+    assert [future.result(5) for future in futures.values()] == [True, True]
+    assert server.backend.executions[make_vin(2)][0] == 'RLF'
+    bmw.close()
+    with pytest.raises(RuntimeError):
+        bmw.execute_service_async('lock', make_vin(0))
+    assert server.backend.requests['remoteservices'] == 3    # Nothing is posted after close()
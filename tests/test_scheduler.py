@@ -0,0 +1,44 @@
+""" Tests of the adaptive polling scheduler """
+
+from bmwcd.mockserver import make_vin
+from bmwcd.scheduler import AdaptiveScheduler
+
+
+def test_is_active_charging():
+    assert AdaptiveScheduler.is_active({'charging_status': 'CHARGINGACTIVE'})
+    assert AdaptiveScheduler.is_active({'charging_status': 'CHARGING'})
+    assert not AdaptiveScheduler.is_active({'charging_status': 'NOCHARGING'})
+    assert not AdaptiveScheduler.is_active({'charging_status': 'CHARGINGENDED'})
+    assert not AdaptiveScheduler.is_active({})
+
+
+def test_is_active_driving():
+    assert AdaptiveScheduler.is_active({}, {'mileage': ('1000', '1010')})
+    assert not AdaptiveScheduler.is_active({}, {'door_lock_state': ('SECURED', 'UNLOCKED')})
+
+
+def test_record_intervals():
+    scheduler = AdaptiveScheduler(active_interval=100, min_interval=300, max_interval=1200, jitter=0)
+    assert scheduler.record('A', {'charging_status': 'CHARGINGACTIVE'}, now=0) == 100
+    assert scheduler.record('B', {}, {'door_lock_state': ('SECURED', 'UNLOCKED')}, now=0) == 300
+    assert scheduler.record('B', {}, {}, now=0) == 600
+    assert scheduler.record('B', None, now=0) == 1200
+    assert scheduler.record('B', None, now=0) == 1200
+
+
+def test_due_and_budget():
+    scheduler = AdaptiveScheduler(jitter=0, budget=2, budget_period=100)
+    assert scheduler.due(['A', 'B', 'C'], now=0) == ['A', 'B']
+    assert scheduler.due(['A', 'B', 'C'], now=50) == []
+    scheduler.record('A', {}, now=0)
+    assert scheduler.due(['A', 'B', 'C'], now=101) == ['B', 'C']
+
+
+def test_update_keeps_healthy_cars(server, connect):
+    server.backend.failures[make_vin(1)] = 500
+    scheduler = AdaptiveScheduler(jitter=0)
+    bmw = connect(scheduler=scheduler)
+    assert [car_data['vin'] for car_data in bmw.update()] == [make_vin(0), make_vin(2)]
+    assert dict(bmw.update_errors) == {make_vin(1): 500}
+    assert scheduler.next_poll_time([make_vin(0), make_vin(1), make_vin(2)]) is not None
+    assert bmw.update() is None     # No car is due yet, also not the failing one
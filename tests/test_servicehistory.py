@@ -0,0 +1,53 @@
+""" Tests of the remote service history and charging profile store """
+
+from bmwcd.mockserver import make_vin
+from bmwcd.servicehistory import ServiceHistoryStore
+
+
+def entry(event_id, creation_time):
+    return {'eventId': event_id, 'type': 'RDL', 'creationTime': creation_time}
+
+
+def test_merge_only_new_entries():
+    store = ServiceHistoryStore()
+    first = [entry('a', '2019-01-01T10:00:00'), entry('b', '2019-01-01T11:00:00')]
+    assert store.merge('V', first) == first
+    assert store.merge('V', first) == []
+    assert store.high_water_mark('V') == '2019-01-01T11:00:00'
+    # A new entry with the same time as the high-water mark is told apart by its eventId
+    second = first + [entry('c', '2019-01-01T11:00:00'), entry('d', '2019-01-01T12:00:00')]
+    assert [new['eventId'] for new in store.merge('V', list(reversed(second)))] == ['c', 'd']
+    assert store.merge('V', second) == []
+    assert [old['eventId'] for old in store.read('V')] == ['a', 'b', 'c', 'd']
+    assert [old['eventId'] for old in store.read('V', since='2019-01-01T10:00:00')] == ['b', 'c', 'd']
+
+
+def test_state_survives_restart(tmp_path):
+    path = str(tmp_path)
+    store = ServiceHistoryStore(path)
+    store.merge('V', [entry('a', '2019-01-01T10:00:00')], etag='"history-1"')
+    store.put_profile('V', '"profile-1"', {'chargingMode': 'IMMEDIATE_CHARGING'})
+
+    store = ServiceHistoryStore(path)
+    assert store.history_etag('V') == '"history-1"'
+    assert store.get_profile('V') == ('"profile-1"', {'chargingMode': 'IMMEDIATE_CHARGING'})
+    assert store.merge('V', [entry('a', '2019-01-01T10:00:00'), entry('b', '2019-01-01T11:00:00')]) == [
+        entry('b', '2019-01-01T11:00:00')]
+    assert [old['eventId'] for old in ServiceHistoryStore(path).read('V')] == ['a', 'b']
+
+
+def test_sync_against_mock_server(server, connect, tmp_path):
+    vin = make_vin(0)
+    bmw = connect(service_history=str(tmp_path))
+    bmw.start()
+    assert bmw.get_service_history(vin) == []
+    server.backend.execute(vin, 'RDL')
+    server.backend.execute(vin, 'RHB')
+    assert [old['type'] for old in bmw.get_service_history(vin)] == ['RDL', 'RHB']
+    assert bmw.sync_service_history(vin) == []      # 304, the ETag did not change
+    assert server.backend.requests['history'] == 3
+
+    profile = bmw.get_charging_profile(vin)
+    assert profile['weeklyPlanner']['chargingMode'] == 'IMMEDIATE_CHARGING'
+    assert bmw.get_charging_profile(vin) == profile
+    assert bmw.service_history.get_profile(vin)[0] == '"chargingprofile-1"'
@@ -0,0 +1,81 @@
+""" Tests of the token manager """
+
+import json
+import threading
+import time
+
+import bmwcd.tokenmanager
+from bmwcd.mockserver import MockServer, make_vin
+from bmwcd.tokenmanager import TokenManager
+
+
+def test_token_single_flight(server, connect):
+    server.backend.latency = 0.05
+    bmw = connect()
+    barrier = threading.Barrier(8)
+
+    def check_token():
+        barrier.wait()
+        bmw.token_valid()
+
+    threads = [threading.Thread(target=check_token) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert server.backend.requests['authenticate'] == 1
+    assert bmw.token_manager.refresh_count == 1
+    assert bmw.is_valid_session
+
+
+def test_token_file(tmp_path):
+    path = str(tmp_path / 'token.json')
+    TokenManager(lambda: ('token', 3600), path=path, account='one', background=False).refresh()
+    assert TokenManager(None, path=path, account='one').accesstoken == 'token'
+    assert TokenManager(None, path=path, account='two').accesstoken is None
+    with open(path, 'w') as token_file:
+        json.dump({'account': 'one', 'accesstoken': 'old', 'token_expires': time.time() - 1}, token_file)
+    assert TokenManager(None, path=path, account='one').accesstoken is None
+
+
+def test_stale_token_file(tmp_path, connect):
+    path = str(tmp_path / 'token.json')
+    with MockServer(vehicles=1) as old_server:
+        bmw = connect(url=old_server.url, auth_url=old_server.auth_url, token_path=path)
+        assert bmw.start()
+        bmw.close()
+    # The new server does not know the saved token, which has not expired yet
+    bmw = connect(token_path=path)
+    assert bmw.token_manager.is_valid()
+    assert [car_data['vin'] for car_data in bmw.update()] == [make_vin(0), make_vin(1), make_vin(2)]
+    assert bmw.token_manager.refresh_count == 1
+    with open(path) as token_file:
+        assert json.load(token_file)['accesstoken'] == bmw.accesstoken
+
+
+def test_rejected_credentials(server, connect):
+    server.backend.username, server.backend.password = 'user', 'secret'
+    bmw = connect()
+    assert not bmw.start()
+    assert bmw.update() is None
+
+
+def test_background_refresh_retry(monkeypatch):
+    monkeypatch.setattr(bmwcd.tokenmanager, 'RETRY_DELAY', 0.01)
+    refreshed = threading.Event()
+    logins = []
+
+    def login():
+        logins.append(time.time())
+        if len(logins) == 2:
+            raise OSError('login failed')
+        if len(logins) == 3:
+            refreshed.set()
+            return 'token3', 7200       # No next refresh during the test
+        return 'token{}'.format(len(logins)), 3600
+
+    manager = TokenManager(login, refresh_margin=3600 - 0.01)
+    manager.refresh()
+    assert refreshed.wait(5)
+    manager.stop()
+    assert manager.accesstoken == 'token3'
@@ -0,0 +1,43 @@
+""" Tests of the typed state of a car, against the attributesMap of the mock server """
+
+from bmwcd.mockserver import MockBackend
+from bmwcd.vehiclestate import ChargingState, DoorLockState, VehicleState, parse_enum
+
+
+def mock_state(**changes):
+    backend = MockBackend()
+    vin = backend.cars[0]['vin']
+    attributes = backend.dynamic(vin)['attributesMap']
+    attributes.update(changes)
+    return VehicleState(attributes, vin=vin)
+
+
+def test_mock_attributes():
+    state = mock_state()
+    assert state.charging_status is ChargingState.NOT_CHARGING
+    assert state.door_lock_state is DoorLockState.SECURED
+    assert state.mileage == 1000
+    assert state.charging_level_hv == 80.0
+    assert state.connector_connected is False
+
+
+def test_charging_states_of_attributes_map():
+    assert mock_state(charging_status='CHARGINGACTIVE').charging_status is ChargingState.CHARGING
+    assert mock_state(charging_status='CHARGINGENDED').charging_status is ChargingState.ENDED
+    assert mock_state(charging_status='CHARGINGPAUSED').charging_status is ChargingState.PAUSED
+    assert mock_state(charging_status='CHARGINGERROR').charging_status is ChargingState.ERROR
+
+
+def test_charging_states_of_vehicle_status():
+    parse = parse_enum(ChargingState)
+    assert parse('CHARGING') is ChargingState.CHARGING
+    assert parse('NOT_CHARGING') is ChargingState.NOT_CHARGING
+    assert parse('FINISHED_FULLY_CHARGED') is ChargingState.ENDED
+    assert parse('SOMETHING_NEW') is ChargingState.UNKNOWN
+
+
+def test_missing_and_empty_fields():
+    state = mock_state(mileage='', gps_lat='not a number')
+    assert state.mileage is None
+    assert state.gps_lat is None
+    assert state.get_raw('nothing', 'default') == 'default'